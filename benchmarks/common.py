@@ -0,0 +1,121 @@
+"""Helpers shared by the benchmark scripts: synthetic sweeps, fake output trees, measurement and history."""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def grid(points, num_params=4):
+    """Choices of `num_params` params whose grid has about `points` combinations"""
+    choice = {}
+    remaining = points
+    for index in range(num_params):
+        # spread the size evenly over the remaining params
+        size = max(1, round(remaining ** (1 / (num_params - index))))
+        choice["p{}".format(index)] = list(range(size))
+        remaining = max(1, remaining // size)
+    return choice
+
+
+def write_params(path, points, commands=2, num_params=4, script="true"):
+    """
+    A params.yaml with a grid of about `points` tasks, each with `commands` no-op commands run one after another.
+    Return the number of tasks.
+    """
+    choice = grid(points, num_params)
+    lines = ["---", "template:"]
+    for index in range(commands):
+        lines.append("  cmd{}: {} {}".format(index, script, " ".join("{%s}" % key for key in choice)))
+    lines.append("default:")
+    lines.extend("  {}: 0".format(key) for key in choice)
+    lines.append("resource: [ 0 ]")
+    lines.append("---")
+    lines.extend("{}: {}".format(key, json.dumps(values)) for key, values in choice.items())
+    with open(path, "w") as fout:
+        fout.write("\n".join(lines) + "\n")
+    total = 1
+    for values in choice.values():
+        total *= len(values)
+    return total
+
+
+def fake_tree(root, num, log_lines=1000, seed=0):
+    """Output directory with `num` finished experiments, each with `param`, `stat` and a log of `log_lines` lines"""
+    import random
+    from mlrunner.utils.misc import yaml_dump
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    for index in range(num):
+        path = os.path.join(root, "Lr_{}-Seed_{}".format(index // 4, index % 4))
+        os.makedirs(path, exist_ok=True)
+        yaml_dump({"lr": index // 4, "seed": index % 4, "_name": os.path.basename(path), "_output": path,
+                   "_time": "20240101.000000"}, os.path.join(path, "param"))
+        yaml_dump({"train": "finished", "_durations": {"train": rng.uniform(10, 100)}}, os.path.join(path, "stat"))
+        with open(os.path.join(path, "log.train.20240101.000000"), "w") as fout:
+            for step in range(log_lines):
+                fout.write("step {} loss {:.4f}\n".format(step, rng.random() / (step + 1)))
+            fout.write("test acc {:.4f}\n".format(rng.random()))
+
+
+def parse_args(argv):
+    """Args of `run` for the given command line"""
+    from mlrunner.cli import build_parser
+    return build_parser().parse_args(argv)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Hide what `run` prints, e.g. a START line per command"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(func, memory=True):
+    """
+    Run func() and return its result, wall time (s) and peak memory (MB) allocated by Python during the call.
+    Memory tracing slows Python code down, so time is measured in a second run without it,
+    the first run also warms up imports and caches.
+    """
+    peak = None
+    if memory:
+        tracemalloc.start()
+    try:
+        func()
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        if memory:
+            tracemalloc.stop()
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start, peak
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def record(benchmark, results, history=None):
+    """Print results, and append them to the `history` file if given, one json line per result"""
+    stamp = {"benchmark": benchmark, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+             "revision": revision(), "python": platform.python_version(), "host": platform.node()}
+    for result in results:
+        print("  ".join("{}={}".format(key, round(value, 4) if isinstance(value, float) else value)
+                        for key, value in result.items()))
+    if history:
+        with open(history, "a") as fout:
+            for result in results:
+                fout.write(json.dumps(dict(stamp, **result)) + "\n")
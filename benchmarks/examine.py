@@ -0,0 +1,68 @@
+"""
+Examination latency on a fake output tree of finished experiments (`param`, `stat` and a log each):
+a full `exam` (serial and parallel), a re-exam from the exam cache, `load_index`, and `table`/`aggregate`.
+
+    $ python benchmarks/examine.py
+    $ python benchmarks/examine.py --experiments 20000 --log-lines 10000 --workers 16
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from common import fake_tree, measure, quiet, record
+
+
+def add_metrics(path, experiment, caches):
+    from mlrunner.examine import latest_log, search
+    log = latest_log("train", path)
+    experiment.metric["loss"] = float(search(log, r"^step \d+ loss ([\d.]+)").group(1))
+    experiment.metric["acc"] = float(search(log, r"^test acc ([\d.]+)").group(1))
+
+
+def examiner(output, **kwargs):
+    from mlrunner.examine import Examiner
+    examiner = Examiner()
+    examiner.add(add_metrics)
+    with quiet():
+        examiner.exam(output=output, **kwargs)
+    return examiner
+
+
+def load_index(output):
+    from mlrunner.examine import Examiner
+    examiner = Examiner()
+    examiner.add(add_metrics)
+    examiner.load_index(output=output, reconcile=True)
+    return examiner
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--experiments", default=[100, 2000], type=int, nargs="+", help="sizes of output trees")
+    parser.add_argument("--log-lines", default=1000, type=int, help="lines of each log")
+    parser.add_argument("--workers", default=4, type=int, help="workers of the parallel exam")
+    parser.add_argument("--history", default=None, help="append results to this json lines file")
+    args = parser.parse_args()
+    # imported beforehand, so that their memory is not counted
+    from mlrunner.examine import Examiner  # noqa: F401
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in args.experiments:
+            output = os.path.join(tmp, "output-{}".format(num))
+            fake_tree(output, num, log_lines=args.log_lines)
+            result = {"experiments": num, "log_lines": args.log_lines}
+            _, result["exam_s"], result["exam_peak_mb"] = measure(lambda: examiner(output, workers=-1))
+            _, result["exam_parallel_s"], _ = measure(lambda: examiner(output, workers=args.workers), memory=False)
+            # the first run fills the cache, the timed one reads it
+            _, result["exam_cached_s"], _ = measure(lambda: examiner(output, workers=-1, cache=True), memory=False)
+            # the first run builds the index and parses metrics, the timed one reads them back
+            exam, result["load_index_s"], _ = measure(lambda: load_index(output), memory=False)
+            _, result["table_s"], _ = measure(exam.table, memory=False)
+            _, result["aggregate_s"], _ = measure(lambda: exam.aggregate(over="seed"), memory=False)
+            results.append(result)
+            shutil.rmtree(output)
+    record("examine", results, args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Planning time and peak memory of `run` on synthetic grids: parsing params.yaml, sweeping the grid and
+building tasks (`build_tasks`), and ordering them (`rank_tasks`). Nothing is run.
+
+    $ python benchmarks/plan.py
+    $ python benchmarks/plan.py --sizes 1000000 --no-memory
+    $ python benchmarks/plan.py --history benchmarks/history.jsonl
+"""
+import argparse
+import os
+import tempfile
+from common import write_params, parse_args, measure, record, quiet
+
+
+def plan(path, output, order):
+    from mlrunner.run import build_tasks, rank_tasks
+    from mlrunner.utils.config import load_yaml
+    args = parse_args(["-y", path, "-o", output, "--order", order])
+    with quiet():
+        resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
+        tasks = build_tasks(args, templates, aliases, defaults, choices)
+    rank_tasks(tasks, order)
+    return len(tasks)
+
+
+def sweep_only(path):
+    # the grid alone, without building tasks
+    from mlrunner.run import sweep
+    from mlrunner.utils.config import load_yaml
+    args = parse_args(["-y", path])
+    with quiet():
+        choices = load_yaml(args)[-1]
+    return sum(1 for choice in choices for _ in sweep({k: v for k, v in choice.items() if not k.startswith("_")}))
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--sizes", default=[10, 1000, 100000], type=int, nargs="+", help="approximate grid sizes")
+    parser.add_argument("--commands", default=2, type=int, help="commands of each task")
+    parser.add_argument("--order", default="index", choices=["index", "fair"])
+    parser.add_argument("--no-memory", default=False, action="store_true",
+                        help="skip the peak memory, which doubles the time of each size")
+    parser.add_argument("--history", default=None, help="append results to this json lines file")
+    args = parser.parse_args()
+    # imported beforehand, so that their memory is not counted
+    import mlrunner.run  # noqa: F401
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, "params.{}.yaml".format(size))
+            total = write_params(path, size, commands=args.commands)
+            _, sweep_time, _ = measure(lambda: sweep_only(path), memory=False)
+            tasks, plan_time, peak = measure(lambda: plan(path, os.path.join(tmp, "output"), args.order),
+                                             memory=not args.no_memory)
+            result = {"size": size, "tasks": tasks, "sweep_s": sweep_time, "plan_s": plan_time,
+                      "tasks_per_s": tasks / plan_time if plan_time else float("inf")}
+            if peak is not None:
+                result["peak_mb"] = peak
+            assert tasks == total, (tasks, total)
+            results.append(result)
+    record("plan", results, args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Scheduler throughput with no-op commands (`true`): commands per second of a full run on `--slots` resource slots,
+and of a second run where every command is skipped as finished, which only reads and writes run states.
+
+    $ python benchmarks/schedule.py
+    $ python benchmarks/schedule.py --tasks 5000 --slots 32 --states sqlite claim
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from common import write_params, parse_args, quiet, record
+
+
+def run_sweep(path, output, slots, state):
+    from mlrunner.run import build_tasks, run_all
+    from mlrunner.utils.config import load_yaml
+    args = parse_args(["-y", path, "-o", output, "--state", state, "-r"] + ["0"] * slots)
+    with quiet():
+        resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
+        tasks = build_tasks(args, templates, aliases, defaults, choices)
+        start = time.perf_counter()
+        asyncio.run(run_all(args, tasks, resources, bindings))
+    return time.perf_counter() - start, sum(len(task["scripts"]) for task in tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--tasks", default=500, type=int, help="approximate number of tasks")
+    parser.add_argument("--commands", default=2, type=int, help="commands of each task")
+    parser.add_argument("--slots", default=8, type=int, help="concurrent resource slots")
+    parser.add_argument("--states", default=["yaml", "sqlite"], nargs="+", choices=["yaml", "sqlite", "claim"])
+    parser.add_argument("--history", default=None, help="append results to this json lines file")
+    args = parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "params.yaml")
+        write_params(path, args.tasks, commands=args.commands)
+        for state in args.states:
+            output = os.path.join(tmp, "output-" + state)
+            run_time, commands = run_sweep(path, output, args.slots, state)
+            skip_time, _ = run_sweep(path, output, args.slots, state)
+            results.append({"state": state, "slots": args.slots, "commands": commands, "run_s": run_time,
+                            "commands_per_s": commands / run_time, "skip_s": skip_time,
+                            "skips_per_s": commands / skip_time})
+    record("schedule", results, args.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import argparse
+from mlrunner.utils.log import has_zstd
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-o", "--output", default="output", help="output directory of all experiments")
+    parser.add_argument("-y", "--yaml", default="params.yaml",
+                        help="yaml configuration file")
+    parser.add_argument("-t", "--title", default=None, help="choose param choices with specified title to sweep")
+    parser.add_argument("-d", "--debug", default=False, action='store_true',
+                        help="debug mode: only run the first task, log will be directed to stdout.")
+    parser.add_argument("--dry-run", default=False, action='store_true',
+                        help="dry run mode: only print the scripts to be run.")
+    parser.add_argument("-c", "--command", default=None, type=str, nargs="+",
+                        help="choose which command to run, by default run all commands")
+    parser.add_argument("-f", "--force", default=False, action="store_true",
+                        help="whether to overwrite tasks successfully ran")
+    parser.add_argument("-r", "--resource", default="", nargs="+",
+                        help="override resources in params.yaml with a space separate list, "
+                             "for example `-r 1,2 3,4` gives ['1,2', '3,4']")
+    parser.add_argument("--auto-gpu", default=False, action="store_true",
+                        help="pack tasks onto gpus by their memory ('_mem', by default --min-mem) and the free memory "
+                             "reported by nvidia-smi, resources give the candidate gpus")
+    parser.add_argument("--min-mem", default=None, type=int,
+                        help="with --auto-gpu, free memory (MiB) required by tasks without '_mem', "
+                             "such tasks take a whole gpu if not given")
+    parser.add_argument("--poll-interval", default=10, type=float,
+                        help="with --auto-gpu, seconds between readings of gpu states, "
+                             "recorded in `gpu_history.csv` under the output directory")
+    parser.add_argument("--cpus", default=4, type=int,
+                        help="number of concurrent commands with '_resource: cpu' in the template")
+    parser.add_argument("--cpu-split", default=None, choices=["even", "numa"],
+                        help="give each resource slot its own cpus, unless declared in params.yaml: 'even' splits all "
+                             "cpus, 'numa' spreads slots over NUMA nodes and splits cpus of each node")
+    parser.add_argument("--threads", default=None, type=int,
+                        help="thread limit (OMP_NUM_THREADS, MKL_NUM_THREADS, ...) of commands on each resource slot "
+                             "without a declared one, by default the number of its cpus if they are given")
+    parser.add_argument("--sample", default=None, type=int,
+                        help="number of random samples from each param choice, by default all params choices are ran")
+    parser.add_argument("--state", default="yaml", choices=["yaml", "sqlite", "claim"],
+                        help="where to keep run states: 'yaml' locks and rewrites `param`/`stat` of each experiment, "
+                             "'sqlite' keeps them in a single database under the output directory and exports "
+                             "`param`/`stat` files for `Examiner`, 'claim' lets `run` processes on several hosts "
+                             "split a sweep through a shared output directory by claiming tasks with exclusive files")
+    parser.add_argument("--heartbeat", default=30, type=float,
+                        help="seconds between heartbeats of running commands. A command marked as running without "
+                             "heartbeat for 4 times as long (or whose process died on this host) is rerun")
+    parser.add_argument("--order", default="index", choices=["index", "fair", "lpt"],
+                        help="order of tasks in the queue after '_priority' of choices: 'index' as in the yaml file, "
+                             "'fair' round robin over choices, 'lpt' longest runtime first, estimated from "
+                             "durations of previous runs or '_cost' of choices")
+    parser.add_argument("--prune", default=None, type=str, nargs="+",
+                        help="stop hopeless commands early: parsers given as `file.py:func`, with the signature of "
+                             "`Examiner.add`, fill the metric (and step) of running commands from their logs")
+    parser.add_argument("--prune-metric", default=None, type=str, help="with --prune, the metric to compare")
+    parser.add_argument("--prune-mode", default="max", choices=["max", "min"],
+                        help="with --prune, whether larger or smaller metrics are better")
+    parser.add_argument("--prune-fraction", default=0.5, type=float,
+                        help="with --prune, the worst fraction of commands to stop at each rung or step")
+    parser.add_argument("--prune-rungs", default=None, type=float, nargs="+",
+                        help="with --prune, steps to compare commands at (asynchronous successive halving), "
+                             "by default running commands are compared with each other at every check")
+    parser.add_argument("--prune-step", default="step", type=str,
+                        help="with --prune, the metric giving the progress of a command, e.g. epoch")
+    parser.add_argument("--prune-interval", default=60, type=float,
+                        help="with --prune, seconds between checks of running commands")
+    parser.add_argument("--prune-command", default=None, type=str, nargs="+",
+                        help="with --prune, commands to prune, by default all")
+    parser.add_argument("--serve", default=None, type=str, metavar="[HOST:]PORT",
+                        help="coordinator mode: own the task queue and lease commands to agents, which run them with "
+                             "their own resources")
+    parser.add_argument("--agent", default=None, type=str, metavar="HOST:PORT",
+                        help="agent mode: run commands leased by the coordinator at HOST:PORT on the resources given "
+                             "by -r, the yaml file is not read")
+    parser.add_argument("--lease-ttl", default=60, type=float,
+                        help="with --serve, seconds before a command not renewed by its agent is leased to another")
+    parser.add_argument("--log-max-size", default=None, type=float, metavar="MB",
+                        help="rotate logs of commands every MB megabytes (before compression)")
+    parser.add_argument("--log-keep", default=None, type=int,
+                        help="with --log-max-size, only keep the last segments of each log")
+    parser.add_argument("--log-compress", default=None, choices=["gzip", "zstd"],
+                        help="compress logs of commands while they are written, zstd requires zstandard")
+    parser.add_argument("--trace", default=None, type=str,
+                        help="where to write the timeline of commands and slots: a Chrome trace (chrome://tracing, "
+                             "Perfetto), or JSON lines of commands if it ends with .jsonl. "
+                             "By default `trace.{time}.json` under the output directory")
+    parser.add_argument("--no-subdir", default=False, action="store_true",
+                        help="do not create separated directory for each param choice")
+
+    return parser
+
+
+def check_args(parser, args):
+    if args.log_compress == "zstd" and not has_zstd():
+        parser.error("--log-compress zstd requires zstandard: pip install zstandard")
+    if args.log_keep is not None and (args.log_keep < 1 or not args.log_max_size):
+        parser.error("--log-keep requires --log-max-size and should be a positive integer")
+    if args.threads is not None and args.threads < 1:
+        parser.error("--threads should be a positive integer")
+    if args.agent and not args.resource:
+        parser.error("--agent requires resources given by -r")
+    if args.serve and (args.prune or args.auto_gpu):
+        parser.error("--prune and --auto-gpu are not supported with --serve")
+    if args.prune and args.prune_metric is None:
+        parser.error("--prune requires --prune-metric")
+    if not 0 <= args.prune_fraction < 1:
+        parser.error("--prune-fraction should be in [0, 1)")
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    check_args(parser, args)
+    # the scheduler (asyncio, yaml, ...) is only imported once args are parsed, which keeps `run -h` fast
+    from mlrunner.run import execute
+    execute(args)
@@ -1 +1,9 @@
-from .examiner import Examiner, latest_log
\ No newline at end of file
+from .reader import tail, search, lines, reverse_lines, latest_log, load_report
+
+
+def __getattr__(name):
+    # pandas, numpy and multiprocess are only imported with the examiner
+    if name == "Examiner":
+        from .examiner import Examiner
+        return Examiner
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,73 @@
+import hashlib
+import inspect
+import os
+import pickle
+from pathlib import Path
+
+
+def parser_key(funcs):
+    """Identity of a set of parsers: their names and source code (or bytecode)"""
+    digests = []
+    for func in funcs:
+        try:
+            source = inspect.getsource(func).encode("utf-8")
+        except (OSError, TypeError):
+            code = getattr(func, "__code__", None)
+            source = code.co_code if code is not None else repr(func).encode("utf-8")
+        name = "{}.{}".format(getattr(func, "__module__", ""), getattr(func, "__qualname__", repr(func)))
+        digests.append(name + ":" + hashlib.sha1(source).hexdigest())
+    return tuple(sorted(digests))
+
+
+def fingerprint(path, key):
+    """Parsers and the size and mtime of `param`, `stat`, `report` and `log.*` files of an experiment"""
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name in ("param", "stat", "report") or entry.name.startswith("log."):
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return key, tuple(sorted(files))
+
+
+class ExamCache(object):
+    """
+    Parsed results of experiments persisted in a file under the output directory:
+    {experiment name: (fingerprint, pickled (param, metric, cache, caches))}
+    Results are pickled one by one, so that unpicklable results are simply not cached.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.dirty = False
+        if self.path.exists():
+            try:
+                with open(self.path, "rb") as fin:
+                    self.entries = pickle.load(fin)
+            except Exception:
+                # corrupted or incompatible cache, rebuild it
+                self.entries = {}
+
+    def get(self, name, stamp):
+        entry = self.entries.get(name, None)
+        if entry is None or entry[0] != stamp:
+            return None
+        return pickle.loads(entry[1])
+
+    def put(self, name, stamp, experiment, caches):
+        try:
+            data = pickle.dumps((experiment.param, experiment.metric, experiment.cache, caches))
+        except Exception:
+            return
+        self.entries[name] = (stamp, data)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "wb") as fout:
+            pickle.dump(self.entries, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.dirty = False
@@ -1,14 +1,14 @@
 import collections
-import glob
-import multiprocessing
 import re
 import os
-import tabulate
+import numpy as np
 import pandas as pd
-from multiprocessing import Pool
 from pathlib import Path
-from multiprocess.pool import Pool
 from ..utils.misc import yaml_load
+from ..utils.index import ExperimentIndex
+from .cache import ExamCache, parser_key, fingerprint
+from .reader import latest_log, load_report
+from .watcher import build_watcher
 
 Experiment = collections.namedtuple("Experiment", ["cache", "metric", "param"])
 
@@ -43,8 +43,13 @@ class Examiner(object):
         experiment.metric["metric1"] = get_metric1(log)
         caches["global_cache1"] = get_global_cache1(log)
 
+    # build global caches once for all experiments, e.g. a shared vocabulary
+    def prepare(paths: list, caches: dict):
+        caches["global_cache2"] = get_global_cache2()
+
     examiner = Examiner()
     examiner.add(func)
+    examiner.prepare(prepare)
     examiner.exam("output", "*")
     examiner.table()
 
@@ -54,18 +59,142 @@ class Examiner(object):
         self.exams = set()
         self.caches = {}
         self.experiments = {}
+        self.stores = {}  # output -> ExamCache
+        self.preparers = []
 
     def add(self, func):
         self.exams.add(func)
 
-    def exam(self, output="output", regex=".*", verbose=False, workers=-1):
+    def prepare(self, func):
+        """
+        Register func(paths: list of pathlib.Path, caches: dict) to build global caches shared by all
+        experiments, called once before parsers in each `exam`. Parallel workers share these caches
+        without rebuilding or copying them.
+        """
+        self.preparers.append(func)
+
+    def exam(self, output="output", regex=".*", verbose=False, workers=-1, cache=False, chunksize=None):
+        """
+        cache: keep parsed results in `output/.examine_cache`, keyed by the source of parsers and the size and
+        mtime of `param`, `stat` and `log.*` files of each experiment. Only experiments with changed inputs are
+        parsed again. Don't use it with parsers reading other files or changing `caches` in place.
+        """
+        for _ in self.iexam(output, regex, verbose, workers, cache, chunksize):
+            pass
+
+    def iexam(self, output="output", regex=".*", verbose=False, workers=-1, cache=False, chunksize=None):
+        """
+        Same as `exam`, but yield the name of each experiment as soon as it is examined,
+        so that partial tables are available during a long examination:
+
+        for i, name in enumerate(examiner.iexam("output", workers=16)):
+            if i % 1000 == 0:
+                print(examiner.table())
+        """
         paths = match_output(output, regex)
+        stamps = {}
+        if cache:
+            store = self._cache_store(output)
+            key = parser_key(self.exams)
+            misses = []
+            for path in paths:
+                stamp = fingerprint(path, key)
+                entry = store.get(path.name, stamp)
+                if entry is None:
+                    stamps[path] = stamp
+                    misses.append(path)
+                else:
+                    param, metric, cache_, caches = entry
+                    self._merge(path, Experiment(cache=cache_, metric=metric, param=param), caches)
+                    yield path.name
+            print("Exam cache: {} hits, {} misses".format(len(paths) - len(misses), len(misses)))
+            paths = misses
+
+        if paths:
+            for func in self.preparers:
+                func(paths, self.caches)
         if workers > 0:
-            self._exam_parallel(paths, verbose, workers)
+            results = self._exam_parallel(paths, verbose, workers, chunksize)
+        else:
+            results = self._exam_serial(paths, verbose)
+        try:
+            for path, experiment, caches in results:
+                if cache:
+                    store.put(path.name, stamps[path], experiment, caches)
+                yield path.name
+        finally:
+            if cache:
+                store.save()
+
+    def watch(self, output="output", regex=".*", interval=5, verbose=False):
+        """
+        Examine all experiments, then follow changes of their `param`, `stat` and `log.*` files
+        (inotify where available, polling otherwise) and re-run parsers only on changed experiments.
+        Yield names of experiments examined in each `interval` seconds, forever:
+
+        for names in examiner.watch("output", interval=10):
+            plot(examiner.table())
+        """
+        watcher = build_watcher(output)
+        pattern = re.compile(regex)
+        try:
+            yield list(self.iexam(output, regex, verbose, workers=-1))
+            while True:
+                changed = [name for name in watcher.poll(interval) if pattern.search(name)]
+                paths = [Path(output, name) for name in sorted(changed)]
+                if paths:
+                    for func in self.preparers:
+                        func(paths, self.caches)
+                yield [path.name for path, _, _ in self._exam_serial(paths, verbose)]
+        finally:
+            watcher.close()
+
+    def load_index(self, output="output", regex=".*", reconcile=False, verbose=False):
+        """
+        Load params and parsed metrics of experiments from the index file under `output` in one read,
+        instead of scanning and parsing every experiment directory. The index is updated by `run`.
+        reconcile: re-read experiments whose directory, `param` or `stat` mtime changed since indexed,
+        run parsers on them (and on experiments without parsed metrics) and save their metrics back to the index.
+        Metrics are not re-parsed when only the parsers change, use `exam` then.
+        Return names of reconciled experiments.
+        """
+        index = ExperimentIndex(output).load()
+        updated = index.reconcile() if reconcile else []
+        pattern = re.compile(regex)
+        for name in index.rows:
+            if not pattern.search(name):
+                continue
+            metric = index.metric(name)
+            self._merge(Path(output, name), Experiment(cache={}, metric=metric or {}, param=index.param(name)), {})
+        # experiments indexed by `run` but never parsed have no metrics
+        paths = [Path(output, name) for name, row in index.rows.items()
+                 if pattern.search(name) and (name in updated or row["metric"] is None)]
+        if reconcile and paths and self.exams:
+            for func in self.preparers:
+                func(paths, self.caches)
+            for path, experiment, _ in self._exam_serial(paths, verbose):
+                index.put_metric(path.name, experiment.metric)
+        index.save()
+        return updated
+
+    def _cache_store(self, output):
+        path = Path(output, ".examine_cache")
+        if self.stores.get(str(output), None) is None:
+            self.stores[str(output)] = ExamCache(path)
+        return self.stores[str(output)]
+
+    def _merge(self, path, experiment, caches):
+        compact(experiment.metric)
+        if path.name not in self.experiments:
+            self.experiments[path.name] = experiment
         else:
-            self._exam_serial(paths, verbose)
+            self.experiments[path.name].param.update(experiment.param)
+            self.experiments[path.name].metric.update(experiment.metric)
+            self.experiments[path.name].cache.update(experiment.cache)
+        self.caches.update(caches)
 
     def _exam_serial(self, paths, verbose):
+        """Yield each examined path, its experiment and the global caches it added"""
         for path in paths:
             params = load_params(path)
             if params is None:
@@ -76,59 +205,135 @@ class Examiner(object):
             if path.name not in self.experiments:
                 self.experiments[path.name] = Experiment(cache={}, metric={}, param={})
             self.experiments[path.name].param.update(params)
+            before = dict(self.caches)
             for e in self.exams:
                 e(path, self.experiments[path.name], self.caches)
+            compact(self.experiments[path.name].metric)
+            yield path, self.experiments[path.name], {k: v for k, v in self.caches.items()
+                                                      if k not in before or before[k] is not v}
 
-    def _exam_parallel(self, paths, verbose, workers):
-        """Parallel version of exam. May repeatedly build shared cache across experiments"""
-
-        def func(path):
-            params = load_params(path)
-            if params is None:
-                print("No 'params' found, skip {}\n".format(path), flush=True, end="")
-                return None, None, None
-            if verbose:
-                print(path.name + '\n', flush=True, end="")
-            experiment = Experiment(cache={}, metric={}, param=params)
-            caches = {}
-            for e in self.exams:
-                e(path, experiment, caches)
-            return path, experiment, caches
-
-        with Pool(processes=workers) as pool:
-            for path, experiment, caches in pool.map(func, paths):
+    def _exam_parallel(self, paths, verbose, workers, chunksize=None):
+        """
+        Parallel version of exam, results are merged as they arrive.
+        Global caches are passed to workers once when they start (copy-on-write with fork),
+        caches added by parsers in workers are merged back.
+        """
+        if not paths:
+            return
+        if chunksize is None:
+            # a few chunks per worker balance the load with little overhead
+            chunksize = max(1, len(paths) // (workers * 4))
+        # dill-based, so that parsers defined in notebooks can be sent to workers
+        from multiprocess.pool import Pool
+        with Pool(processes=workers, initializer=init_worker, initargs=(self.exams, self.caches, verbose)) as pool:
+            for path, experiment, caches in pool.imap_unordered(exam_path, paths, chunksize=chunksize):
                 if path is None:
                     continue
-                if path.name not in self.experiments:
-                    self.experiments[path.name] = experiment
-                else:
-                    self.experiments[path.name].param.update(experiment.param)
-                    self.experiments[path.name].metric.update(experiment.metric)
-                    self.experiments[path.name].cache.update(experiment.cache)
-                self.caches.update(caches)
+                self._merge(path, experiment, caches)
+                yield path, self.experiments[path.name], caches
 
     def table(self, concise=True, print_tsv=False):
-        params = set([(k, v) for experiment in self.experiments.values()
-                      for k, v in experiment.param.items() if not re.match("_", k)])
-        count = collections.Counter(k for k, _ in params)
+        params, metrics = self.frames(concise)
+        headers = list(params.columns) + list(metrics.columns)
+        df = pd.concat([params, metrics], axis=1).reset_index(drop=True)
+        if print_tsv:
+            tsv_table(df.values.tolist(), headers)
+        return df
+
+    def frames(self, concise=True):
+        """Params and metrics of all experiments as two data frames indexed by experiment name"""
+        names = pd.Index(list(self.experiments.keys()), name="name")
+        params = pd.DataFrame.from_records([experiment.param for experiment in self.experiments.values()],
+                                           index=names)
+        param_headers = sorted(k for k in params.columns if not re.match("_", str(k)))
         if concise:
             # remove columns with the same values
-            param_headers = sorted(k for k, c in count.items() if c > 1)
+            param_headers = [k for k in param_headers if num_unique(params[k]) > 1]
+        metrics = pd.DataFrame.from_records([experiment.metric for experiment in self.experiments.values()],
+                                            index=names)
+        return params[param_headers], metrics[sorted(metrics.columns)]
+
+    def series(self, metric):
+        """
+        A series metric (e.g. per epoch loss) of all experiments as an array:
+        one row per experiment, one column per step, padded with NaN.
+        """
+        names = [name for name, experiment in self.experiments.items() if metric in experiment.metric]
+        arrays = [np.asarray(self.experiments[name].metric[metric], dtype=float).ravel() for name in names]
+        data = np.full((len(arrays), max((len(array) for array in arrays), default=0)), np.nan)
+        for i, array in enumerate(arrays):
+            data[i, :len(array)] = array
+        return pd.DataFrame(data, index=pd.Index(names, name="name"))
+
+    def aggregate(self, over="seed", metrics=None, series=None):
+        """
+        Mean and std of metrics across experiments only differing in `over`, e.g. different random seeds.
+        metrics: scalar metrics to aggregate, by default all numeric ones
+        series: a series metric to aggregate step by step instead
+        """
+        params, scalars = self.frames(concise=True)
+        params = params.drop(columns=[over], errors="ignore")
+        if series is not None:
+            values = self.series(series)
+        elif metrics is None:
+            values = scalars.select_dtypes("number")
         else:
-            param_headers = sorted(count.keys())
+            values = scalars[metrics]
+        if values.columns.empty:
+            raise ValueError("No numeric metric to aggregate" if series is None
+                             else "No experiment has the series metric '{}'".format(series))
+        if params.empty:
+            return values.agg(["mean", "std"]).T if series is None else values.agg(["mean", "std"])
+        keys = [params.loc[values.index, k].map(hashable) for k in params.columns]
+        grouped = values.groupby(keys, dropna=False)
+        if series is not None:
+            return pd.concat({"mean": grouped.mean(), "std": grouped.std()}, axis=1)
+        return grouped.agg(["mean", "std"])
 
-        metric_headers = set()
-        for experiment in self.experiments.values():
-            metric_headers.update(experiment.metric.keys())
-        metric_headers = sorted(metric_headers)
 
-        headers = param_headers + metric_headers
-        entries = [[experiment.param.get(h, None) for h in param_headers] +
-                   [experiment.metric.get(h, None) for h in metric_headers]
-                   for experiment in self.experiments.values()]
-        if print_tsv:
-            tsv_table(entries, headers)
-        return pd.DataFrame(entries, columns=headers)
+def hashable(value):
+    return value if isinstance(value, collections.abc.Hashable) else repr(value)
+
+
+def num_unique(column):
+    return column.map(hashable).nunique()
+
+
+def compact(metric):
+    """Keep numeric series of a metric dict as numpy arrays of their dtype, other values as they are"""
+    for key, value in metric.items():
+        if isinstance(value, (list, tuple)) and value:
+            try:
+                array = np.asarray(value)
+            except (ValueError, TypeError):
+                # ragged nested lists
+                continue
+            if array.ndim == 1 and array.dtype.kind in "iuf":
+                metric[key] = array
+    return metric
+
+
+# states of parallel workers
+WORKER = {}
+
+
+def init_worker(exams, caches, verbose):
+    WORKER.update(exams=exams, caches=caches, verbose=verbose)
+
+
+def exam_path(path):
+    params = load_params(path)
+    if params is None:
+        print("No 'params' found, skip {}\n".format(path), flush=True, end="")
+        return None, None, None
+    if WORKER["verbose"]:
+        print(path.name + '\n', flush=True, end="")
+    experiment = Experiment(cache={}, metric={}, param=params)
+    # new caches go to the first map, shared ones are read from the second
+    caches = collections.ChainMap({}, WORKER["caches"])
+    for e in WORKER["exams"]:
+        e(path, experiment, caches)
+    return path, experiment, caches.maps[0]
 
 
 def match_output(output="output", regex=".*"):
@@ -144,14 +349,3 @@ def load_params(path):
         return None
     params = yaml_load(param_path)
     return params
-
-
-def latest_log(command, path, index=-1):
-    """Get the latest log path of the command"""
-    path = Path(path)
-    log_paths = sorted(path.glob("log.{}.*".format(command)))
-    num_logs = len(log_paths)
-    assert isinstance(index, int)
-    if index < -num_logs or index > num_logs - 1:
-        return None
-    return log_paths[index]
@@ -0,0 +1,110 @@
+import io
+import mmap
+import re
+from pathlib import Path
+from ..reporting import read_report
+from ..utils.log import log_segments, open_segment, split_segment
+
+
+def segments(path):
+    """Files of a log: its segments if it is rotated or compressed, otherwise the file itself"""
+    return log_segments(path) or [str(path)]
+
+
+def read_lines(segment, encoding="utf-8"):
+    # lines of a compressed segment, up to the last flushed block if it is still being written
+    with open_segment(segment) as fin:
+        reader = io.TextIOWrapper(fin, encoding=encoding, errors="replace")
+        try:
+            for line in reader:
+                yield line.rstrip("\r\n")
+        except (EOFError, OSError):
+            return
+
+
+def reverse_segment(path, encoding="utf-8"):
+    if path.endswith((".gz", ".zst")):
+        # no random access in a compressed stream, segments are bounded by rotation
+        yield from reversed(list(read_lines(path, encoding)))
+        return
+    with open(path, "rb") as fin:
+        try:
+            buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        with buffer:
+            end = len(buffer)
+            if end and buffer[end - 1:end] == b"\n":
+                end -= 1
+            while end >= 0:
+                start = buffer.rfind(b"\n", 0, end) + 1
+                yield buffer[start:end].decode(encoding, errors="replace").rstrip("\r")
+                if start == 0:
+                    break
+                end = start - 1
+
+
+def reverse_lines(path, encoding="utf-8"):
+    """Iterate lines from the end of a log, reading only the pages holding them"""
+    for segment in reversed(segments(path)):
+        yield from reverse_segment(segment, encoding)
+
+
+def tail(path, n=1, encoding="utf-8"):
+    """Last n lines of a file, in order"""
+    result = []
+    for line in reverse_lines(path, encoding):
+        if len(result) >= n:
+            break
+        result.append(line)
+    return result[::-1]
+
+
+def search(path, pattern, encoding="utf-8"):
+    r"""
+    Match of the last line matching the regex pattern, searched backwards, or None.
+    e.g. float(search(log, r"test_acc=([\d.]+)").group(1))
+    """
+    pattern = re.compile(pattern)
+    for line in reverse_lines(path, encoding):
+        match = pattern.search(line)
+        if match is not None:
+            return match
+    return None
+
+
+def lines(path, encoding="utf-8"):
+    """Iterate lines of a log from the beginning without loading the whole file"""
+    for segment in segments(path):
+        if segment.endswith((".gz", ".zst")):
+            yield from read_lines(segment, encoding)
+            continue
+        with open(segment, "r", encoding=encoding, errors="replace") as fin:
+            for line in fin:
+                yield line.rstrip("\r\n")
+
+
+def load_report(path, experiment, caches):
+    """
+    A parser of metrics sent with `mlrunner.report`, read from the `report` file without parsing logs.
+    A metric reported several times becomes the series of its values.
+    """
+    for name, values in read_report(path).items():
+        values = [value for value in values if value is not None]
+        if not name.startswith("_") and values:
+            experiment.metric[name] = values if len(values) > 1 else values[0]
+
+
+def latest_log(command, path, index=-1):
+    """
+    Get the latest log path of the command. A rotated or compressed log is given by the path of its first
+    segment without the compression extension, which the readers (`tail`, `search`, `lines`) accept.
+    """
+    path = Path(path)
+    log_paths = sorted(set(Path(split_segment(log)[0]) for log in path.glob("log.{}.*".format(command))))
+    num_logs = len(log_paths)
+    assert isinstance(index, int)
+    if index < -num_logs or index > num_logs - 1:
+        return None
+    return log_paths[index]
@@ -0,0 +1,162 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# inotify(7) event masks
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct("iIII")
+
+
+def is_watched(name):
+    """Files of an experiment that parsers read"""
+    return name in ("param", "stat", "report") or name.startswith("log.")
+
+
+def stamp(path):
+    # size and mtime of watched files of an experiment
+    files = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if is_watched(entry.name):
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    except FileNotFoundError:
+        return None
+    return tuple(sorted(files))
+
+
+class PollingWatcher(object):
+    """Find changed experiments by polling the size and mtime of their files."""
+
+    def __init__(self, root, scan=True):
+        self.root = root
+        self.scan = scan  # look for new experiment directories under root
+        self.stamps = {}  # experiment name -> stamp
+        if scan:
+            self.changes()
+
+    def add(self, name):
+        self.stamps[name] = stamp(os.path.join(self.root, name))
+
+    def changes(self):
+        if self.scan:
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name not in self.stamps:
+                        self.stamps[entry.name] = None
+        changed = set()
+        for name, prev in self.stamps.items():
+            current = stamp(os.path.join(self.root, name))
+            if current != prev:
+                self.stamps[name] = current
+                changed.add(name)
+        return changed
+
+    def poll(self, interval):
+        """Experiment names changed during the next `interval` seconds"""
+        time.sleep(interval)
+        return self.changes()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Find changed experiments by inotify events of their `param`, `stat`, `report` and `log.*` files,
+    so that the cost only depends on the number of changes.
+    Experiments that can't be watched (e.g. the limit of watches is reached) are polled instead.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # watch descriptor -> experiment name, None for the root
+        self.names = set()
+        self.fallback = PollingWatcher(root, scan=False)
+        self.watch(root, None, IN_CREATE | IN_MOVED_TO)
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.add(entry.name)
+
+    def watch(self, path, name, mask):
+        wd = self.add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", path)
+        self.watches[wd] = name
+
+    def add(self, name):
+        self.names.add(name)
+        try:
+            self.watch(os.path.join(self.root, name), name, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        except OSError as error:
+            if error.errno != errno.ENOSPC:
+                raise
+            self.fallback.add(name)
+
+    def read(self):
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                filename = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0"))
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # events are lost, check all experiments
+                    changed.update(self.names)
+                    continue
+                if wd not in self.watches:
+                    continue
+                name = self.watches[wd]
+                if name is None:
+                    if mask & IN_ISDIR and filename not in self.names:
+                        self.add(filename)
+                        changed.add(filename)
+                elif is_watched(filename):
+                    changed.add(name)
+
+    def poll(self, interval):
+        """Experiment names changed during the next `interval` seconds"""
+        deadline = time.time() + interval
+        changed = set()
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed.update(self.read())
+        if self.fallback.stamps:
+            changed.update(self.fallback.changes())
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def build_watcher(root):
+    """inotify where available, polling otherwise"""
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError):
+        return PollingWatcher(root)
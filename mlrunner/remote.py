@@ -0,0 +1,371 @@
+import asyncio
+import collections
+import itertools
+import json
+import os
+import signal
+import socket
+import time
+from mlrunner.utils.misc import color_print
+from mlrunner.utils.gpu import SlotPool
+from mlrunner.utils.cpu import bind, pin, thread_env
+from mlrunner.utils.log import spawn, finish
+from mlrunner.utils.report import ReportServer
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """'host:port' or 'port' -> (host, port)"""
+    host, _, port = str(address).rpartition(":")
+    return host or default_host, int(port)
+
+
+async def post(address, path, payload, timeout=None):
+    """POST a json payload to the coordinator and return its json response"""
+    host, port = address
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        body = json.dumps(payload).encode("utf-8")
+        head = "POST {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n" \
+               "Connection: close\r\n\r\n".format(path, host, port, len(body))
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    status = head.split(b" ", 2)[1:2]
+    if status != [b"200"]:
+        raise ConnectionError("{} {}: {}".format(path, head.split(b"\r\n")[0].decode("latin-1"), body[:200]))
+    return json.loads(body.decode("utf-8"))
+
+
+class LeasePool(object):
+    """
+    Slots offered by agents asking the coordinator for work, as a pool for `dispatch`.
+    Acquiring a slot gives the future of a waiting `/lease` request, which is resolved with a lease.
+    Acquired offers are taken: they are resolved, or released, by the dispatcher only, never withdrawn.
+    """
+
+    def __init__(self):
+        self.offers = collections.deque()
+        self.waiters = []
+        self.taken = set()  # offers acquired by the dispatcher and not resolved yet
+        self.withdrawn = set()  # taken offers whose request no longer waits for them once released
+
+    async def ready(self):
+        pass
+
+    def check(self, demand):
+        pass
+
+    def offer(self, num):
+        offers = [asyncio.get_event_loop().create_future() for _ in range(num)]
+        self.offers.extend(offers)
+        self.wake()
+        return offers
+
+    def wake(self):
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.waiters = []
+
+    def withdraw(self, offers):
+        """Cancel offers not taken, return those taken but not resolved yet"""
+        pending = []
+        for offer in offers:
+            if offer in self.taken:
+                self.withdrawn.add(offer)
+                pending.append(offer)
+            elif not offer.done():
+                offer.cancel()
+        return pending
+
+    def acquire(self, demand):
+        while self.offers:
+            offer = self.offers.popleft()
+            if not offer.done():
+                self.taken.add(offer)
+                return offer
+        return None
+
+    def resolve(self, offer, lease):
+        self.taken.discard(offer)
+        self.withdrawn.discard(offer)
+        offer.set_result(lease)
+
+    def release(self, demand, resource):
+        self.taken.discard(resource)
+        if resource in self.withdrawn:
+            # its request is returning, without a lease
+            self.withdrawn.discard(resource)
+            resource.cancel()
+        elif not resource.done():
+            # a slot not leased (e.g. the command is skipped) is offered again
+            self.offers.appendleft(resource)
+            self.wake()
+
+    def changed(self):
+        # registered right away, so that offers made before the dispatcher waits are not missed
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        return waiter
+
+    async def take(self, demand):
+        """Wait for a slot"""
+        while True:
+            offer = self.acquire(demand)
+            if offer is not None:
+                return offer
+            await self.changed()
+
+
+class Coordinator(object):
+    """
+    `run --serve`: owns the task queue and run states, and leases commands to agents over HTTP with json bodies.
+    POST /lease  {agent, gpu, cpu}     free slots of an agent -> {leases: [...], done}, waiting up to `poll` seconds
+    POST /renew  {agent, leases}       keep leases of running commands alive -> {expired: [...]}
+    POST /report {agent, lease, status, duration}
+    A lease not renewed within `ttl` seconds is given to another agent.
+    """
+
+    def __init__(self, address, ttl=60, poll=10):
+        self.address = address
+        self.ttl = ttl
+        self.poll = poll
+        self.pools = {"gpu": LeasePool(), "cpu": LeasePool()}
+        self.leases = {}  # lease id -> {"lease", "expires", "report" future}
+        self.ids = itertools.count()
+        self.done = False
+        self.server = None
+        self.routes = {"/lease": self.lease, "/renew": self.renew, "/report": self.report}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, *self.address)
+        print("Serving on {}:{}".format(*self.address))
+
+    async def stop(self):
+        self.done = True
+        # answer waiting agents, and those asking shortly after, that all tasks are done
+        for pool in self.pools.values():
+            pool.withdraw(pool.offers)
+        await asyncio.sleep(min(self.poll, 2))
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            await self.respond(reader, writer)
+        finally:
+            writer.close()
+
+    async def respond(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ", 2)
+            headers = {key.strip().lower(): value.strip() for key, _, value in
+                       (line.partition(":") for line in lines[1:] if line)}
+            length = int(headers.get("content-length", 0))
+            payload = json.loads(await reader.readexactly(length)) if length else {}
+            if method != "POST" or path not in self.routes:
+                status, result = "404 Not Found", {"error": "no route {} {}".format(method, path)}
+            else:
+                status, result = "200 OK", await self.routes[path](payload)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as error:
+            status, result = "400 Bad Request", {"error": str(error)}
+        body = json.dumps(result).encode("utf-8")
+        writer.write("HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, len(body)).encode("latin-1") + body)
+        await writer.drain()
+
+    async def lease(self, payload):
+        if self.done:
+            return {"leases": [], "done": True}
+        offers = []
+        for pool in ["gpu", "cpu"]:
+            offers += self.pools[pool].offer(int(payload.get(pool, 0)))
+        if offers:
+            await asyncio.wait(offers, timeout=self.poll, return_when=asyncio.FIRST_COMPLETED)
+            # the dispatcher hands out commands in one go, give it a moment to fill the other slots
+            await asyncio.sleep(0.01)
+        pending = []
+        for pool in self.pools.values():
+            pending += pool.withdraw(offers)
+        if pending:
+            # taken by the dispatcher, which leases them after updating run states
+            await asyncio.wait(pending, timeout=self.poll)
+            for offer in pending:
+                # run_remote waits for another offer
+                offer.cancel()
+        leases = []
+        for offer in offers:
+            if offer.done() and not offer.cancelled():
+                lease = offer.result()
+                lease["agent"] = payload.get("agent", None)
+                self.leases[lease["id"]]["expires"] = time.time() + self.ttl
+                leases.append(lease)
+        return {"leases": leases, "done": self.done, "ttl": self.ttl}
+
+    async def renew(self, payload):
+        expired = []
+        for lease_id in payload.get("leases", []):
+            if lease_id in self.leases and self.leases[lease_id]["lease"].get("agent") == payload.get("agent"):
+                self.leases[lease_id]["expires"] = time.time() + self.ttl
+            else:
+                expired.append(lease_id)
+        return {"expired": expired}
+
+    async def report(self, payload):
+        entry = self.leases.get(payload.get("lease", None), None)
+        if entry is None or entry["lease"].get("agent") != payload.get("agent"):
+            # expired and given to another agent
+            return {"accepted": False}
+        if not entry["report"].done():
+            entry["report"].set_result(payload)
+        return {"accepted": True}
+
+    async def run_remote(self, offer, pool, demand, lease):
+        """Hand the lease to agents until one reports it, return the report"""
+        while True:
+            while offer.done():
+                # withdrawn meanwhile, e.g. the coordinator stops waiting for it
+                self.pools[pool].release(demand, offer)
+                offer = await self.pools[pool].take(demand)
+            lease = dict(lease, id=next(self.ids))
+            entry = {"lease": lease, "expires": time.time() + self.ttl,
+                     "report": asyncio.get_event_loop().create_future()}
+            self.leases[lease["id"]] = entry
+            self.pools[pool].resolve(offer, lease)
+            try:
+                while not entry["report"].done():
+                    remaining = entry["expires"] - time.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.wait([entry["report"]], timeout=remaining)
+            finally:
+                del self.leases[lease["id"]]
+            if entry["report"].done():
+                return entry["report"].result()
+            color_print("EXPIRED {}: {}, lease of agent {}".format(lease["command"], lease["output"],
+                                                                   lease.get("agent")), "yellow")
+            offer = await self.pools[pool].take(demand)
+
+
+class Agent(object):
+    """
+    `run --agent host:port`: pulls commands from the coordinator, runs them on local `resource` slots
+    and reports their status. Outputs are written to the same paths as on the coordinator host,
+    use a shared filesystem to collect them in one place.
+    """
+
+    def __init__(self, address, resources, cpus=4, name=None, bindings=None, logging=None):
+        self.address = address
+        self.bindings = bindings  # cpus and thread limits of local resource slots
+        self.logging = logging  # options of the log sink
+        self.pools = {"gpu": SlotPool(resources), "cpu": SlotPool([""] * cpus)}
+        self.name = name or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.running = {}  # asyncio task -> lease
+        self.ttl = None  # lease ttl given by the coordinator
+        self.reporter = ReportServer()  # metrics sent by commands with mlrunner.report
+
+    async def run(self, retry=60):
+        await self.reporter.start()
+        renewing = asyncio.ensure_future(self.renew())
+        requests = {}  # pending /lease request -> slots asked for
+        asked = collections.Counter()
+        done = False
+        failed_since = None
+        try:
+            while not done or self.running or requests:
+                # ask for free slots not asked for yet, while earlier requests are pending
+                ask = {pool: len(self.pools[pool].free) - asked[pool] for pool in self.pools}
+                if not done and any(num > 0 for num in ask.values()):
+                    request = asyncio.ensure_future(post(self.address, "/lease", dict(ask, agent=self.name),
+                                                         timeout=60))
+                    requests[request] = ask
+                    asked.update(ask)
+                finished, _ = await asyncio.wait(list(self.running) + list(requests),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                self.reap()
+                for request in finished:
+                    if request not in requests:
+                        continue
+                    asked.subtract(requests.pop(request))
+                    try:
+                        response = request.result()
+                        failed_since = None
+                    except (OSError, ConnectionError, asyncio.TimeoutError) as error:
+                        # the coordinator is gone when all tasks are done
+                        failed_since = failed_since or time.time()
+                        if time.time() - failed_since > retry:
+                            color_print("Coordinator unreachable: {}".format(error), "red")
+                            done = True
+                        await asyncio.sleep(1)
+                        continue
+                    self.ttl = response.get("ttl", self.ttl)
+                    done = done or response["done"]
+                    for lease in response["leases"]:
+                        resource = self.pools[lease["pool"]].acquire({})
+                        job = asyncio.ensure_future(self.run_lease(lease, resource))
+                        self.running[job] = (lease, resource)
+        finally:
+            renewing.cancel()
+            for job in list(self.running) + list(requests):
+                job.cancel()
+            await asyncio.gather(renewing, *self.running, *requests, return_exceptions=True)
+            await self.reporter.stop()
+
+    def reap(self):
+        for job in [job for job in self.running if job.done()]:
+            lease, resource = self.running.pop(job)
+            self.pools[lease["pool"]].release({}, resource)
+            if not job.cancelled():
+                job.result()
+
+    async def run_lease(self, lease, resource):
+        info = "{:8}:{:2d}/{:2d}, {}".format(lease["command"], lease["index"] + 1, lease["total"], lease["output"])
+        info = ("gpu: {}, ".format(resource) if lease["pool"] == "gpu" else "cpu, ") + info
+        print("START   " + info)
+        os.makedirs(lease["output"], exist_ok=True)
+        start = time.time()
+        binding = bind(self.bindings, resource) if lease["pool"] == "gpu" else None
+        prefix = ["CUDA_VISIBLE_DEVICES={}".format(resource)]
+        prefix += ["{}={}".format(key, value) for key, value in thread_env(binding).items()]
+        script = "{} {}".format(" ".join(prefix), lease["script"])
+        process, reader = await spawn(script, lease["log"], self.logging, start_new_session=True,
+                                      prefix=pin(binding),
+                                      env=dict(os.environ, **self.reporter.env(lease["output"], lease["command"])))
+        try:
+            code = await finish(process, reader)
+        except asyncio.CancelledError:
+            os.killpg(process.pid, signal.SIGTERM)
+            raise
+        status = "finished" if code == 0 else "failed"
+        if status == "failed":
+            color_print("FAIL    " + info, "red")
+        for _ in range(10):
+            try:
+                await post(self.address, "/report", {"agent": self.name, "lease": lease["id"], "status": status,
+                                                     "duration": time.time() - start}, timeout=30)
+                return
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                await asyncio.sleep(3)
+        color_print("Failed to report {}".format(info), "red")
+
+    async def renew(self):
+        while True:
+            await asyncio.sleep(self.ttl / 4 if self.ttl else 1)
+            leases = [lease["id"] for job, (lease, _) in self.running.items() if not job.done()]
+            if not leases:
+                continue
+            try:
+                response = await post(self.address, "/renew", {"agent": self.name, "leases": leases}, timeout=30)
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                continue
+            expired = set(response["expired"])
+            for job, (lease, _) in list(self.running.items()):
+                if lease["id"] in expired and not job.done():
+                    # given to another agent
+                    color_print("EXPIRED {}: {}".format(lease["command"], lease["output"]), "yellow")
+                    job.cancel()
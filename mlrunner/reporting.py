@@ -0,0 +1,128 @@
+import json
+import os
+import pickle
+import socket
+import sys
+import time
+
+REPORT = "report"  # file of reported metrics in the experiment directory
+ENV_SOCKET = "MLRUNNER_REPORT"
+ENV_OUTPUT = "MLRUNNER_OUTPUT"
+ENV_COMMAND = "MLRUNNER_COMMAND"
+
+
+def to_columns(records):
+    """[{name: value}] -> {name: [values]}, None where a record misses a name"""
+    names = []
+    for record in records:
+        names.extend(name for name in record if name not in names)
+    return {name: [record.get(name, None) for record in records] for name in names}
+
+
+def append_chunk(output, records):
+    """Append records to the report of an experiment as one pickled chunk of columns, in a single write"""
+    data = pickle.dumps(to_columns(records), protocol=4)
+    fd = os.open(os.path.join(output, REPORT), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_report(output):
+    """Reported records of an experiment as columns {name: [values]}, including `_command` and `_time`"""
+    chunks = []
+    try:
+        with open(os.path.join(output, REPORT), "rb") as fin:
+            while True:
+                try:
+                    chunks.append(pickle.load(fin))
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    # a chunk being written
+                    break
+    except FileNotFoundError:
+        return {}
+    columns = {}
+    length = 0
+    for chunk in chunks:
+        size = len(next(iter(chunk.values()), []))
+        for name in chunk:
+            columns.setdefault(name, [None] * length)
+        for name, values in columns.items():
+            values.extend(chunk.get(name, [None] * size))
+        length += size
+    return columns
+
+
+connection = None
+
+
+def to_json(value):
+    # numpy and torch arrays and scalars, anything else as a string
+    try:
+        if getattr(value, "ndim", 0) and hasattr(value, "tolist"):
+            return value.tolist()
+        if hasattr(value, "item"):
+            return value.item()
+        if hasattr(value, "tolist"):
+            return value.tolist()
+    except Exception:
+        pass
+    return str(value)
+
+
+def encode(record):
+    """A json line of a record, metrics that can't be serialized (e.g. circular ones) are kept as strings"""
+    try:
+        return json.dumps(record, default=to_json)
+    except (TypeError, ValueError, OverflowError):
+        metrics = {}
+        for name, value in record["metrics"].items():
+            try:
+                json.dumps(value, default=to_json)
+                metrics[str(name)] = value
+            except (TypeError, ValueError, OverflowError):
+                metrics[str(name)] = str(value)
+        return json.dumps(dict(record, metrics=metrics), default=to_json)
+
+
+def report(**metrics):
+    """
+    Record metrics of the running command, e.g. report(step=100, loss=0.5), without printing them to be parsed.
+    They are sent to `run` through the socket in the environment variable MLRUNNER_REPORT, or appended
+    to the `report` file of the experiment without it. Return False if not started by `run`, or if they
+    could not be recorded, it never raises.
+    """
+    global connection
+    output = os.environ.get(ENV_OUTPUT, None)
+    if output is None:
+        return False
+    record = {"output": output, "command": os.environ.get(ENV_COMMAND, None), "time": time.time(),
+              "metrics": metrics}
+    # never fail the training job for a metric
+    line = (encode(record) + "\n").encode("utf-8")
+    path = os.environ.get(ENV_SOCKET, None)
+    for _ in range(2):
+        if path is None:
+            break
+        try:
+            if connection is None:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(path)
+            connection.sendall(line)
+            return True
+        except OSError:
+            # run has restarted or is gone, reconnect once
+            if connection is not None:
+                connection.close()
+            connection = None
+    # the same values as sent through the socket
+    metrics = json.loads(line.decode("utf-8"))["metrics"]
+    try:
+        append_chunk(output, [dict(metrics, _command=record["command"], _time=record["time"])])
+    except OSError as error:
+        sys.stderr.write("mlrunner.report: metrics not recorded, {}\n".format(error))
+        return False
+    return True
@@ -1,19 +1,30 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import argparse
+import collections
+import heapq
 import random
 import itertools
 import shlex
-import re
 import types
-import copy
 import sys
 import os
 import shutil
+import signal
+import time
 from datetime import datetime
-from mlrunner.utils.misc import spec2name, map_placeholder, map_replacement, shell_arg, \
-    yaml_load, yaml_dump, color_print, edit_yaml
-from mlrunner.utils.config import load_yaml, InvalidYAMLException
+from mlrunner.utils.misc import spec2name, shell_arg, color_print
+from mlrunner.utils.config import load_yaml, check_demand, InvalidYAMLException
+from mlrunner.utils.template import CommandTemplate
+from mlrunner.utils.state import build_state
+from mlrunner.utils.index import ExperimentIndex
+from mlrunner.utils.gpu import build_pool, SlotPool, GpuPool, GpuTelemetry
+from mlrunner.utils.prune import Pruner, load_parsers
+from mlrunner.remote import Coordinator, Agent, parse_address
+from mlrunner.utils.cpu import build_bindings, bind, pin, thread_env
+from mlrunner.utils.log import spawn, finish, log_options
+from mlrunner.utils.report import ReportServer
+from mlrunner.utils.trace import Tracer
+from mlrunner.cli import main  # the entry point of older installs
 
 TIME = datetime.now().strftime("%Y%m%d.%H%M%S")
 
@@ -36,21 +47,42 @@ def run(coro):
 
 
 def sweep(param2choices, num_sample=None):
-    # random combination of param choices
+    # lazily stream combinations of param choices, optionally a random subset of them
     for key, values in param2choices.items():
         if not isinstance(values, list):
             raise InvalidYAMLException("{} should be a list, not {}".format(key, type(values)))
 
-    param_choices = [[(key, value) for value in values] for key, values in param2choices.items()]
-    cand_params = [list(param) for param in itertools.product(*param_choices)]
-    if num_sample is not None:
-        random.shuffle(cand_params)
-        params = cand_params[:num_sample]
-        params.sort()
+    keys = list(param2choices.keys())
+    choices = [param2choices[key] for key in keys]
+    if num_sample is None:
+        for values in itertools.product(*choices):
+            yield dict(zip(keys, values))
+        return
+
+    total = 1
+    for values in choices:
+        total *= len(values)
+    # draw distinct indices of the grid and decode them as mixed-radix numbers,
+    # so that the cost only depends on num_sample instead of the grid size.
+    if total <= sys.maxsize:
+        indices = random.sample(range(total), min(num_sample, total))
     else:
-        params = cand_params
-    param_dicts = [dict(param) for param in params]
-    return param_dicts
+        # range() of such grids is too large for random.sample, and num_sample is tiny in comparison,
+        # so that distinct indices are found with hardly any redraw
+        indices = set()
+        while len(indices) < num_sample:
+            indices.add(random.randrange(total))
+    for index in sorted(indices):
+        yield decode_index(index, keys, choices)
+
+
+def decode_index(index, keys, choices):
+    # the last param varies the fastest, consistent with itertools.product
+    param_dict = {}
+    for key, values in zip(reversed(keys), reversed(choices)):
+        index, digit = divmod(index, len(values))
+        param_dict[key] = values[digit]
+    return {key: param_dict[key] for key in keys}
 
 
 # param_dict updates
@@ -87,102 +119,142 @@ def parse_choice(args, choice, aliases, defaults):
         del choice["_cmd"]
     else:
         commands = None
-    entries = []
-    for spec in sweep(choice, num_sample=args.sample):
-        name = spec2name(spec, str_maxlen=100)
-        meta = {
-            "_name":   name,
-            "_time":   TIME,
-            "_output": args.output if args.no_subdir else os.path.join(args.output, name)
-        }
-        map_alias(spec, aliases)
-        add_default(spec, defaults)
-        entries.append((spec, meta))
-    return commands, entries
+    # resource demands of all tasks in this choice
+    demand = {}
+    for key in ["_mem", "_gpus"]:
+        if key in choice:
+            if len(choice[key]) != 1:
+                raise InvalidYAMLException("'{}' should be a single value, not {}".format(key, choice[key]))
+            demand[key.strip("_")] = check_demand("choice", key, choice[key][0])
+            del choice[key]
+    # scheduling hints of all tasks in this choice: priority and estimated runtime (seconds) of a task
+    hints = {}
+    for key in ["_priority", "_cost"]:
+        if key in choice:
+            values = choice[key]
+            if len(values) != 1 or isinstance(values[0], bool) or not isinstance(values[0], (int, float)):
+                raise InvalidYAMLException("'{}' should be a single number, not {}".format(key, choice[key]))
+            hints[key.strip("_")] = values[0]
+            del choice[key]
+
+    def entries():
+        for spec in sweep(choice, num_sample=args.sample):
+            name = spec2name(spec, str_maxlen=100)
+            meta = {
+                "_name":   name,
+                "_time":   TIME,
+                "_output": args.output if args.no_subdir else os.path.join(args.output, name)
+            }
+            map_alias(spec, aliases)
+            add_default(spec, defaults)
+            yield spec, meta
+
+    return commands, demand, hints, entries()
+
+
+def freeze(value):
+    # hashable counterpart of a yaml value
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def spec_key(spec):
+    # canonical form of a spec: equal specs give equal keys regardless of the key order
+    return tuple(sorted((key, freeze(value)) for key, value in spec.items()))
+
+
+def build_graph(templates, commands, demand):
+    """
+    Commands to run for tasks of a choice: their dependencies, resource pool ('gpu' or 'cpu') and demand.
+    Commands without '_after' run after the previous command, as they are listed in 'template'.
+    """
+    selected = [command for command in templates if not commands or command in commands]
+    graph = {}
+    for order, command in enumerate(selected):
+        template = templates[command]
+        if "_after" in template:
+            # dependencies not selected to run are assumed done
+            after = [dependency for dependency in template["_after"] if dependency in selected]
+        else:
+            after = selected[order - 1:order]
+        pool = template.get("_resource", "gpu")
+        node_demand = {}
+        if pool == "gpu":
+            node_demand = {key.strip("_"): template[key] for key in ["_mem", "_gpus"] if key in template}
+            # demands of the choice override those of the template
+            node_demand.update(demand)
+        graph[command] = {"order": order, "after": after, "before": [], "pool": pool, "demand": node_demand}
+    for command, node in graph.items():
+        for dependency in node["after"]:
+            graph[dependency]["before"].append(command)
+
+    # topological sort for circular dependencies
+    waiting = {command: len(node["after"]) for command, node in graph.items()}
+    ready = [command for command, count in waiting.items() if count == 0]
+    while ready:
+        for dependent in graph[ready.pop()]["before"]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    circular = [command for command, count in waiting.items() if count > 0]
+    if circular:
+        raise InvalidYAMLException("circular dependencies among commands {}".format(circular))
+    return graph
 
 
 def build_tasks(args, templates, aliases, defaults, choices):
     def uniq_entries(entries):
         for spec, meta in entries:
-            if spec in uniq_entries.uniq_spec:
+            key = spec_key(spec)
+            if key in uniq_entries.uniq_spec:
                 # allow the same task with different command.
                 # repeated commands will be skipped later by checking stat
                 if meta["_output"] not in uniq_entries.uniq_output:
                     continue
             else:
-                uniq_entries.uniq_spec.append(copy.deepcopy(spec))
-                uniq_entries.uniq_output.append(meta["_output"])
+                uniq_entries.uniq_spec.add(key)
+                uniq_entries.uniq_output.add(meta["_output"])
             yield spec, meta
 
-    uniq_entries.uniq_spec = []
-    uniq_entries.uniq_output = []
+    # hash indexes for O(1) lookup of duplicated specs
+    uniq_entries.uniq_spec = set()
+    uniq_entries.uniq_output = set()
 
+    compiled = {}  # command -> CommandTemplate, compiled once on first use
     tasks = []
     orphans = set()  # track params not consumed by any command
-    for choice in choices:
-        commands, entries = parse_choice(args, choice, aliases, defaults)
+    for number, choice in enumerate(choices):
+        commands, demand, hints, entries = parse_choice(args, choice, aliases, defaults)
         if args.command:
             # command line option will override those in the yaml config
             commands = args.command
+        graph = build_graph(templates, commands, demand)  # shared by tasks of the choice
         entries = uniq_entries(entries)
         for spec, meta in entries:
             unused_params = set(spec.keys())  # avoid accidentally missing the param in the template
             spec.update(meta)
             scripts = {}
-            for command, template in templates.items():
-                if commands and command not in commands:
-                    continue
-                template = re.sub(r"\s*\n\s*", " ", template)  # clean up line breaks
+            logs = {}
+            for command in graph:
+                if command not in compiled:
+                    compiled[command] = CommandTemplate(templates[command]["script"], aliases)
+                template = compiled[command]
+                unused_params.difference_update(template.params)
                 # fill placeholder with params
-                empties = set()
-                placeholders = re.findall(r"{[\w\-\_]+?}", template)  # {param} -> value
-                replacements = re.findall(r"\[[\w\-\_]+?\]", template)  # [param] -> --param value
-                intersect = set(p.strip("{}") for p in placeholders) & set(r.strip("[]") for r in replacements)
-                if intersect:
-                    raise InvalidYAMLException("duplicate params in placeholder and replacement: {}".format(intersect))
-
-                for placeholder in placeholders:
-                    param = placeholder.strip("{}")
-                    if param in aliases:
-                        raise InvalidYAMLException(
-                                "alias param '{}' should not be specified in template.".format(param))
-                    if param in unused_params:
-                        unused_params.remove(param)
-                    if param in spec:
-                        template = template.replace(placeholder, map_placeholder(spec, param))
-                    else:
-                        empties.add(placeholder)
-
-                for replacement in replacements:
-                    param = replacement.strip("[]")
-                    if param in aliases:
-                        raise InvalidYAMLException(
-                                "alias param '{}' should not be specified in template.".format(param))
-                    if param in unused_params:
-                        unused_params.remove(param)
-                    if param in spec:
-                        template = template.replace(replacement, map_replacement(spec, param))
-                    else:
-                        empties.add(replacement)
-                if empties:
-                    raise InvalidYAMLException("params {} are not specified in 'default' or 'choice'".format(empties))
-
-                # prepare suffix for logging
+                scripts[command] = template.render(spec)
+
+                # stdout and stderr are captured by the scheduler into the log
                 if args.no_subdir:
                     log = "log.{}.{}.{}".format(command, spec["_time"], spec["_name"])
                 else:
                     log = "log.{}.{}".format(command, spec["_time"])
-                log = shell_arg(os.path.join(spec["_output"], log))
-
-                if args.debug:
-                    # log_path may contain tokens that should be escaped in shell.
-                    # os.makedirs implicitly handle it, here we should handle it explicitly.
-                    suffix = "2>&1 | tee {}".format(log) + "; exit ${PIPESTATUS[0]}"
-                else:
-                    suffix = "> {} 2>&1".format(log)
-                scripts[command] = template + " " + suffix
+                logs[command] = os.path.join(spec["_output"], log)
             orphans.update(unused_params)
-            tasks.append({"spec": spec, "scripts": scripts})
+            tasks.append({"spec": spec, "scripts": scripts, "logs": logs, "graph": graph, "choice": number,
+                          "hints": hints, "dumped": False})
     color_print("Orphan params: {}".format(orphans), "red")
     if args.debug:
         tasks = tasks[:1]
@@ -190,126 +262,366 @@ def build_tasks(args, templates, aliases, defaults, choices):
     return tasks
 
 
-async def build_worker(tasks, queue, resource, skips, fails, force=False, dry_run=False):
-    while True:
-        index = await queue.get()
-        spec, scripts = tasks[index]["spec"], tasks[index]["scripts"]
-        prefix = "CUDA_VISIBLE_DEVICES={}".format(resource)
-        for command, script in scripts.items():
-            scripts[command] = " ".join([prefix, script])
-        spec["_scripts"] = scripts
-
-        os.makedirs(spec["_output"], exist_ok=True)
-        # dump param
-        with edit_yaml(spec["_output"], "param") as prev_spec:
-            if not prev_spec:
-                prev_spec.update(spec)
+def rank_tasks(tasks, order="index", durations=None):
+    """
+    Set the rank of each task in the queue, smaller ones start first: tasks of choices with a larger '_priority'
+    go first, then tasks are ordered by
+    'index': their order in params.yaml
+    'fair': round robin over choices
+    'lpt': longest estimated runtime first. Runtime of a task comes from `durations` of its previous run
+           ({experiment name: {command: seconds}}), '_cost' of its choice, or the mean duration of the same
+           command in its choice (or in all choices).
+    """
+    durations = durations or {}
+    known = {}  # (choice, command) or command -> durations of previous runs
+    for task in tasks:
+        for command, seconds in durations.get(os.path.basename(task["spec"]["_output"]), {}).items():
+            known.setdefault((task["choice"], command), []).append(seconds)
+            known.setdefault(command, []).append(seconds)
+    means = {key: sum(values) / len(values) for key, values in known.items()}
+
+    def estimate(task):
+        previous = durations.get(os.path.basename(task["spec"]["_output"]), {})
+        if all(command in previous for command in task["graph"]):
+            return sum(previous[command] for command in task["graph"])
+        if "cost" in task["hints"]:
+            return task["hints"]["cost"]
+        return sum(previous.get(command, means.get((task["choice"], command), means.get(command, 0)))
+                   for command in task["graph"])
+
+    positions = collections.Counter()  # number of tasks of each choice so far
+    for index, task in enumerate(tasks):
+        if order == "lpt":
+            key = -estimate(task)
+        elif order == "fair":
+            key = positions[task["choice"]]
+            positions[task["choice"]] += 1
+        else:
+            key = 0
+        task["rank"] = (-task["hints"].get("priority", 0), key, index)
+
+
+async def dispatch(tasks, pools, state, skips, fails, force=False, dry_run=False, exp_index=None, pruner=None,
+                   coordinator=None, bindings=None, logging=None, reporter=None, tracer=None):
+    """
+    Start commands of tasks whenever their dependencies finish and their pools have room,
+    until all commands finish. Dependents of a failed command never start.
+    """
+    for pool in pools.values():
+        await pool.ready()
+    ready = {}  # (pool, demand) -> heap of (task rank, order, command, task index)
+    waiting = []  # task index -> {command: number of unfinished dependencies}
+
+    def push(index, command):
+        node = tasks[index]["graph"][command]
+        key = (node["pool"], demand_key(node["demand"]))
+        if key not in ready:
+            pools[node["pool"]].check(node["demand"])
+            ready[key] = []
+        heapq.heappush(ready[key], (tasks[index]["rank"], node["order"], command, index))
+        if tracer is not None:
+            tracer.ready(index, command)
+
+    for index, task in enumerate(tasks):
+        waiting.append({command: len(node["after"]) for command, node in task["graph"].items()})
+        for command, node in task["graph"].items():
+            if not node["after"]:
+                push(index, command)
+
+    def head(key):
+        # by priority first, then first-fit decreasing on gpus: larger commands are placed first,
+        # then the rest of the rank and the order of commands in the task
+        rank, order, _, _ = ready[key][0]
+        size = key[1] if isinstance(pools[key[0]], GpuPool) else (0, 0)
+        return rank[0], tuple(-value for value in size), rank[1:], order
+
+    running = {}  # asyncio task -> (index, command, resource)
+    delayed = {}  # asyncio sleep -> (index, command) held by another process
+    try:
+        while ready or running or delayed:
+            # start the first ready command across all demands, until no pool has room for the rest
+            full = set()  # demands that don't fit now
+            while len(full) < len(ready):
+                key = min((key for key in ready if key not in full), key=head)
+                _, _, command, index = ready[key][0]
+                node = tasks[index]["graph"][command]
+                resource = pools[node["pool"]].acquire(node["demand"])
+                if resource is None:
+                    # smaller demands may still fit
+                    full.add(key)
+                    continue
+                heapq.heappop(ready[key])
+                if not ready[key]:
+                    del ready[key]
+                if tracer is not None:
+                    tracer.acquire(index, command, node["pool"], resource)
+                job = asyncio.ensure_future(run_command(tasks, index, command, resource, state, skips, fails,
+                                                        force, dry_run, exp_index, pruner, coordinator,
+                                                        bindings, logging, reporter, tracer))
+                running[job] = (index, command, resource)
+            # retry when a command finishes or a pool changes
+            waiters = [asyncio.ensure_future(pool.changed()) for pool in pools.values()]
+            done, _ = await asyncio.wait(list(running) + list(delayed) + waiters, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+            for job in done:
+                if job in delayed:
+                    push(*delayed.pop(job))
+                if job not in running:
+                    continue
+                index, command, resource = running.pop(job)
+                node = tasks[index]["graph"][command]
+                pools[node["pool"]].release(node["demand"], resource)
+                if tracer is not None:
+                    tracer.release(index, command)
+                result = job.result()  # raise errors
+                if not isinstance(result, bool):
+                    delayed[asyncio.ensure_future(asyncio.sleep(result))] = (index, command)
+                elif result:
+                    for dependent in node["before"]:
+                        waiting[index][dependent] -= 1
+                        if waiting[index][dependent] == 0:
+                            push(index, dependent)
+    finally:
+        for job in list(running) + list(delayed):
+            job.cancel()
+        await asyncio.gather(*running, *delayed, return_exceptions=True)
+
+
+def demand_key(demand):
+    return demand.get("mem", 0), demand.get("gpus", 1)
+
+
+async def run_command(tasks, index, command, resource, state, skips, fails, force=False, dry_run=False,
+                      exp_index=None, pruner=None, coordinator=None, bindings=None, logging=None, reporter=None,
+                      tracer=None):
+    """
+    Run a command of a task, or lease it to an agent of the coordinator. Return whether its dependents can run,
+    or the seconds to wait before trying it again when its task is held by another process.
+    """
+    spec = tasks[index]["spec"]
+    node = tasks[index]["graph"][command]
+    # cpu commands are not bound, they share the cpus left to them
+    binding = bind(bindings, resource) if node["pool"] == "gpu" and coordinator is None else None
+    if coordinator is None:
+        # cpu commands get an empty resource, which hides all gpus
+        prefix = ["CUDA_VISIBLE_DEVICES={}".format(resource)]
+        prefix += ["{}={}".format(key, value) for key, value in thread_env(binding).items()]
+        script = "{} {}".format(" ".join(prefix), tasks[index]["scripts"][command])
+    else:
+        # agents prefix their own resources
+        script = tasks[index]["scripts"][command]
+
+    os.makedirs(spec["_output"], exist_ok=True)
+    # dump param once per task, with scripts of all its commands, which may run on different resources
+    if not tasks[index]["dumped"]:
+        state.update_param(spec["_output"], dict(spec, _scripts=dict(tasks[index]["scripts"])))
+        tasks[index]["dumped"] = True
+    info = "{:8}:{:2d}/{:2d}, {}".format(command, index + 1, len(tasks), shell_arg(spec["_output"]))
+    started = False
+    process = None
+    status, code = None, None  # for the tracer
+    # a process group of its own, so that pruning stops the shell with its children
+    pruning = pruner is not None and pruner.watches(command)
+    try:
+        if not state.begin(spec["_output"], command, force=force):
+            delay = state.retry_after(spec["_output"], command)
+            if delay is False:
+                color_print("SKIP " + info + ", failed in another process", "yellow")
+                skips.append(spec["_output"])
+                status = "skipped"
+                return False
+            if delay is not None:
+                # written by whichever process ends up with the task
+                tasks[index]["dumped"] = False
+                color_print("HELD    {}, by another process".format(info), "yellow")
+                status = "held"
+                return delay
+            color_print("SKIP " + info, "green")
+            skips.append(spec["_output"])
+            status = "skipped"
+            return True
+        started = True
+        state.export()
+        if coordinator is not None:
+            info = "{}, ".format(node["pool"]) + info
+        elif node["pool"] == "gpu":
+            info = "gpu: {}, ".format(resource) + info
+        else:
+            info = "cpu, " + info
+        print(("LEASE   " if coordinator is not None else "START   ") + info)
+        log = tasks[index]["logs"][command]
+        if dry_run:
+            print("{} > {}".format(script, shell_arg(log)))
+            await asyncio.sleep(0.05)
+            return True
+        if tracer is not None:
+            tracer.start(index, command, spec["_output"])
+        if coordinator is not None:
+            lease = {"output": spec["_output"], "command": command, "script": script, "log": log,
+                     "pool": node["pool"], "index": index, "total": len(tasks)}
+            report = await coordinator.run_remote(resource, node["pool"], node["demand"], lease)
+            code = 0 if report["status"] == "finished" else 1
+            duration = report.get("duration", 0)
+        else:
+            start = time.time()
+            # the report socket changes with every run, so it is left out of the recorded script
+            env = dict(os.environ, **reporter.env(spec["_output"], command)) if reporter is not None else None
+            process, reader = await spawn(script, log, logging, start_new_session=pruning, prefix=pin(binding),
+                                          env=env)
+            if pruning:
+                pruner.track(spec["_output"], command, spec, process)
+                try:
+                    code = await finish(process, reader)
+                finally:
+                    pruner.untrack(spec["_output"], command)
             else:
-                for key, value in spec.items():
-                    # don't overwrite old commands
-                    if key == "_scripts":
-                        prev_spec[key].update(spec[key])
-                    else:
-                        prev_spec[key] = spec[key]
-        for command, script in scripts.items():
-            info = "{:8}:{:2d}/{:2d}, {}".format(command, index + 1, queue.maxsize, shell_arg(spec["_output"]))
-            try:
-                with edit_yaml(spec["_output"], "stat") as stat:
-                    if command in stat and stat[command] in ["finished", "running"] and not force:
-                        color_print("SKIP " + info, "green")
-                        skips.append(spec["_output"])
-                        continue
-                    else:
-                        stat[command] = "running"
-                info = "gpu: {}, ".format(resource) + info
-                print("START   " + info)
-                if dry_run:
-                    print(script)
-                    await asyncio.sleep(0.05)
-                else:
-                    process = await asyncio.create_subprocess_shell(script, executable='/bin/bash')
-                    await process.wait()
-                    code = process.returncode
-                    stat_path = os.path.join(spec["_output"], "stat")
-                    with edit_yaml(spec["_output"], "stat") as stat:
-                        if code != 0:
-                            stat[command] = "failed"
-                            color_print("FAIL    " + info, "red")
-                            fails.append(spec["_output"])
-                            break
-                        else:
-                            stat[command] = "finished"
-            except Exception as exception:
-                with edit_yaml(spec["_output"], "stat") as stat:
-                    stat[command] = "failed"
-                    fails.append(spec["_output"])
-                raise exception
-            except asyncio.CancelledError as error:
-                with edit_yaml(spec["_output"], "stat") as stat:
-                    stat[command] = "failed"
-                    fails.append(spec["_output"])
-                raise error
-        queue.task_done()
-
-
-async def run_all(args, tasks, resources):
-    # populate the task queue
+                code = await finish(process, reader)
+            duration = time.time() - start
+        if pruning and pruner.is_pruned(spec["_output"], command):
+            status = "pruned"
+            state.transition([(spec["_output"], command, "pruned")])
+            return False
+        if code != 0:
+            status = "failed"
+            state.transition([(spec["_output"], command, "failed")])
+            color_print("FAIL    " + info, "red")
+            fails.append(spec["_output"])
+            return False
+        status = "finished"
+        state.transition([(spec["_output"], command, "finished")],
+                         durations={(spec["_output"], command): duration})
+        return True
+    except Exception as exception:
+        status = "failed"
+        state.transition([(spec["_output"], command, "failed")])
+        fails.append(spec["_output"])
+        raise exception
+    except asyncio.CancelledError as error:
+        if pruning and process is not None and process.returncode is None:
+            # not in the foreground process group, so it is not interrupted with us
+            os.killpg(process.pid, signal.SIGTERM)
+        status = "cancelled"
+        state.transition([(spec["_output"], command, "failed")])
+        fails.append(spec["_output"])
+        raise error
+    finally:
+        if tracer is not None and status is not None:
+            tracer.finish(index, command, status, code)
+        state.export()
+        if started and exp_index is not None:
+            exp_index.update(spec["_output"])
+            exp_index.save(interval=10)
+
+
+async def keep_alive(state, interval):
+    while True:
+        await asyncio.sleep(interval)
+        state.beat()
+
+
+async def run_all(args, tasks, resources, bindings=None):
+    # count tasks and commands
     task_num = len(tasks)
     cmd_num = sum(len(task["scripts"]) for task in tasks)
     print("Tasks: {}, Commands: {}".format(task_num, cmd_num))
-    queue = asyncio.Queue(maxsize=task_num)
-    for index in range(task_num):
-        queue.put_nowait(index)
-    # build workers that consuming tasks in task_
     skips = []
     fails = []
-    workers = []
-    loop = asyncio.get_event_loop()
-    for resource in resources:
-        workers.append(loop.create_task(build_worker(tasks, queue, resource, skips, fails, force=args.force,
-                                                     dry_run=args.dry_run)))
-    await queue.join()
-
-    for worker in workers:
-        worker.cancel()
-    await asyncio.gather(*workers, return_exceptions=True)
+    # a running command is lost if its heartbeat is not refreshed for several intervals
+    state = build_state(args.state, args.output, ttl=4 * args.heartbeat)
+    heartbeat = asyncio.ensure_future(keep_alive(state, args.heartbeat))
+    telemetry = None
+    coordinator = None
+    if args.serve:
+        # agents bring their own resources
+        coordinator = Coordinator(parse_address(args.serve, "0.0.0.0"), ttl=args.lease_ttl)
+        await coordinator.start()
+    elif args.auto_gpu:
+        telemetry = GpuTelemetry(interval=args.poll_interval, history=os.path.join(args.output, "gpu_history.csv"))
+        telemetry.start()
+    elif any(node["demand"] for task in tasks for node in task["graph"].values()):
+        color_print("'_mem' and '_gpus' only take effect with --auto-gpu.", "yellow")
+    if coordinator is not None:
+        pools = coordinator.pools
+    else:
+        pools = {"gpu": build_pool(args, resources, telemetry), "cpu": SlotPool([""] * args.cpus)}
+        # with --auto-gpu, cpus are split among gpus, and commands get the cpus of all their gpus
+        slots = resources if not args.auto_gpu else pools["gpu"].gpus
+        bindings = build_bindings(slots, bindings, mode=args.cpu_split, threads=args.threads)
+    tracer = None if args.dry_run else Tracer()
+    reporter = None
+    if coordinator is None and not args.dry_run:
+        # metrics sent by commands with mlrunner.report
+        reporter = ReportServer()
+        await reporter.start()
+    exp_index = ExperimentIndex(args.output)
+    durations = None
+    if args.order == "lpt":
+        # durations of previous runs from the index, synced with experiment directories
+        exp_index.load()
+        exp_index.reconcile()
+        durations = {name: exp_index.stat(name).get("_durations", {}) for name in exp_index.rows}
+    rank_tasks(tasks, args.order, durations)
+    pruner = None
+    if args.prune:
+        pruner = Pruner(load_parsers(args.prune), args.prune_metric, mode=args.prune_mode,
+                        fraction=args.prune_fraction, rungs=args.prune_rungs, step=args.prune_step,
+                        interval=args.prune_interval, commands=args.prune_command)
+        checking = asyncio.ensure_future(pruner.loop())
+    try:
+        # nothing to index in a dry run
+        await dispatch(tasks, pools, state, skips, fails, force=args.force, dry_run=args.dry_run,
+                       exp_index=None if args.dry_run else exp_index, pruner=pruner, coordinator=coordinator,
+                       bindings=bindings, logging=log_options(args), reporter=reporter, tracer=tracer)
+    finally:
+        if coordinator is not None:
+            await coordinator.stop()
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        if pruner is not None:
+            checking.cancel()
+            await asyncio.gather(checking, return_exceptions=True)
+        if telemetry is not None:
+            await telemetry.stop()
+        if reporter is not None:
+            await reporter.stop()
+        state.close()
+        exp_index.save()
+    if tracer is not None:
+        trace = args.trace or os.path.join(args.output, "trace.{}.json".format(TIME))
+        tracer.write(trace)
+        for line in tracer.summary(tasks):
+            print(line)
+        print("Trace: {}".format(trace))
+    # commands of the same task are counted once
+    skips = list(dict.fromkeys(skips))
+    fails = list(dict.fromkeys(fails))
     if skips:
         color_print("Skipped tasks: {}/{}".format(len(skips), len(tasks)), "green")
         for name in skips:
             color_print('    {}'.format(name), "green")
 
+    if pruner is not None and pruner.pruned:
+        color_print("Pruned commands: {}".format(len(pruner.pruned)), "yellow")
+        for output, command in sorted(pruner.pruned):
+            color_print('    {}: {}'.format(command, output), "yellow")
+
     if fails:
-        color_print("Failed tasks: {}/{}".format(len(skips), len(tasks)), "red")
+        color_print("Failed tasks: {}/{}".format(len(fails), len(tasks)), "red")
         for name in fails:
             color_print('    {}'.format(name), "red")
     else:
         color_print("No task failed.", "green")
 
 
-def main():
-    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("-o", "--output", default="output", help="output directory of all experiments")
-    parser.add_argument("-y", "--yaml", default="params.yaml",
-                        help="yaml configuration file")
-    parser.add_argument("-t", "--title", default=None, help="choose param choices with specified title to sweep")
-    parser.add_argument("-d", "--debug", default=False, action='store_true',
-                        help="debug mode: only run the first task, log will be directed to stdout.")
-    parser.add_argument("--dry-run", default=False, action='store_true',
-                        help="dry run mode: only print the scripts to be run.")
-    parser.add_argument("-c", "--command", default=None, type=str, nargs="+",
-                        help="choose which command to run, by default run all commands")
-    parser.add_argument("-f", "--force", default=False, action="store_true",
-                        help="whether to overwrite tasks successfully ran")
-    parser.add_argument("-r", "--resource", default="", nargs="+",
-                        help="override resources in params.yaml with a space separate list, "
-                             "for example `-r 1,2 3,4` gives ['1,2', '3,4']")
-    parser.add_argument("--sample", default=None, type=int,
-                        help="number of random samples from each param choice, by default all params choices are ran")
-    parser.add_argument("--no-subdir", default=False, action="store_true",
-                        help="do not create separated directory for each param choice")
-
-    args = parser.parse_args()
-    resources, templates, aliases, defaults, choices = load_yaml(args)
+def execute(args):
+    """Run (or serve, or pull from a coordinator) the sweep given by the checked command-line args"""
+    if args.agent:
+        bindings = build_bindings(args.resource, mode=args.cpu_split, threads=args.threads)
+        run(Agent(parse_address(args.agent), args.resource, cpus=args.cpus, bindings=bindings,
+                  logging=log_options(args)).run())
+        return
+    resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
     print(choices)
     tasks = build_tasks(args, templates, aliases, defaults, choices)
 
@@ -317,4 +629,4 @@ def main():
     yaml_bak = os.path.basename(args.yaml)
     yaml_bak_path = os.path.join(args.output, yaml_bak if args.title is None else yaml_bak + "." + args.title)
     shutil.copyfile(args.yaml, yaml_bak_path)
-    run(run_all(args, tasks, resources))
+    run(run_all(args, tasks, resources, bindings))
@@ -1,5 +1,6 @@
 import yaml
 from .misc import color_print
+from .cpu import parse_cpulist
 
 
 class InvalidYAMLException(Exception):
@@ -20,6 +21,8 @@ def parse_config(config):
     templates = safe_load("template", dict, required=True)
     if not templates:
         raise InvalidYAMLException("No template exists.")
+    templates = {name: parse_template(name, template) for name, template in templates.items()}
+    check_dependencies(templates)
     resources = safe_load("resource", list, required=True)
 
     def not_emtpy_dict(name, obj):
@@ -50,6 +53,74 @@ def parse_config(config):
     return templates, resources, aliases, defaults
 
 
+def check_demand(name, key, value):
+    # _mem: estimated memory (MiB) per gpu, _gpus: number of gpus
+    minimum = 0 if key == "_mem" else 1
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise InvalidYAMLException("'{}' of {} should be an integer >= {}.".format(key, name, minimum))
+    return value
+
+
+def parse_template(name, template):
+    # a template is either the script, or a dict with the script, its dependencies and resource demands:
+    #   test: { script: "python test.py {data}", _after: [ train ], _resource: gpu, _mem: 4000, _gpus: 1 }
+    if isinstance(template, str):
+        return {"script": template}
+    if not isinstance(template, dict) or not isinstance(template.get("script", None), str):
+        raise InvalidYAMLException("template[{}] should be a str, or a dict with a str 'script'.".format(name))
+    unknown = set(template.keys()) - {"script", "_after", "_resource", "_mem", "_gpus"}
+    if unknown:
+        raise InvalidYAMLException("unknown keys {} in template[{}].".format(unknown, name))
+    for key in ["_mem", "_gpus"]:
+        if key in template:
+            check_demand("template[{}]".format(name), key, template[key])
+    if "_after" in template:
+        if isinstance(template["_after"], str):
+            template["_after"] = [template["_after"]]
+        if not isinstance(template["_after"], list):
+            raise InvalidYAMLException("'_after' of template[{}] should be a list of commands.".format(name))
+    if template.get("_resource", "gpu") not in ["gpu", "cpu"]:
+        raise InvalidYAMLException("'_resource' of template[{}] should be 'gpu' or 'cpu'.".format(name))
+    return template
+
+
+def parse_resources(resources):
+    # a resource is either the gpus, or a dict with the gpus, the cpus and the thread limit of commands on them:
+    #   { gpu: 0, cpus: "0-7", threads: 8 }
+    names = []
+    bindings = {}
+    for resource in resources:
+        if not isinstance(resource, dict):
+            names.append(str(resource))
+            continue
+        if "gpu" not in resource or set(resource.keys()) - {"gpu", "cpus", "threads"}:
+            raise InvalidYAMLException("resource {} should have 'gpu', and optionally 'cpus' and 'threads'.".format(
+                    resource))
+        name = str(resource["gpu"])
+        names.append(name)
+        binding = {}
+        if "cpus" in resource:
+            try:
+                binding["cpus"] = parse_cpulist(resource["cpus"])
+            except ValueError as error:
+                raise InvalidYAMLException("'cpus' of resource {}: {}".format(name, error))
+        if "threads" in resource:
+            if isinstance(resource["threads"], bool) or not isinstance(resource["threads"], int) \
+                    or resource["threads"] < 1:
+                raise InvalidYAMLException("'threads' of resource {} should be a positive integer.".format(name))
+            binding["threads"] = resource["threads"]
+        bindings[name] = binding
+    return names, bindings
+
+
+def check_dependencies(templates):
+    for name, template in templates.items():
+        for command in template.get("_after", []):
+            if command not in templates:
+                raise InvalidYAMLException("template[{}] runs after '{}', which is not in 'template'.".format(
+                        name, command))
+
+
 def filter_choices(title, choices):
     if not choices:
         raise InvalidYAMLException("No choices available.")
@@ -91,7 +162,7 @@ def load_yaml(args):
     if args.resource:
         print("Override resource to {}".format(repr(args.resource)))
         resources = args.resource
-    resources = [str(i) for i in resources]
+    resources, bindings = parse_resources(resources)
     # we dub each doc specifying a grid sweep of different params a "choice"
     choices = filter_choices(args.title, docs[1:])
-    return resources, templates, aliases, defaults, choices
+    return resources, bindings, templates, aliases, defaults, choices
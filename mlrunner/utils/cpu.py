@@ -0,0 +1,146 @@
+import glob
+import os
+import re
+import shutil
+from .misc import color_print
+
+
+def parse_cpulist(cpulist):
+    """'0-3,8,10-11' (as in taskset and /sys) or a list of cpus -> sorted list of cpus"""
+    if isinstance(cpulist, int):
+        return [cpulist]
+    if isinstance(cpulist, (list, tuple)):
+        return sorted(set(int(cpu) for cpu in cpulist))
+    cpus = set()
+    for part in str(cpulist).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d+)(?:-(\d+))?", part)
+        if match is None:
+            raise ValueError("invalid cpu list '{}'".format(cpulist))
+        start, end = int(match.group(1)), int(match.group(2) or match.group(1))
+        cpus.update(range(start, end + 1))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    """[0, 1, 2, 3, 8] -> '0-3,8'"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(start) if start == end else "{}-{}".format(start, end) for start, end in ranges)
+
+
+def numa_nodes():
+    """cpus of each NUMA node usable by this process, a single node if the topology is unknown"""
+    usable = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"),
+                       key=lambda path: int(re.search(r"node(\d+)", path).group(1))):
+        with open(path) as fin:
+            cpus = [cpu for cpu in parse_cpulist(fin.read()) if cpu in usable]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(usable)]
+
+
+def split(cpus, num):
+    """Split cpus into num contiguous chunks of (almost) equal sizes"""
+    chunks = []
+    for index in range(num):
+        chunk = cpus[len(cpus) * index // num:len(cpus) * (index + 1) // num]
+        # more slots than cpus: share them
+        chunks.append(chunk or [cpus[index * len(cpus) // num]])
+    return chunks
+
+
+def split_cpus(resources, mode="numa"):
+    """
+    Disjoint cpu sets for resource slots: {resource: [cpus]}.
+    'even': contiguous chunks of all usable cpus.
+    'numa': slots are spread over NUMA nodes, and cpus of a node are split among its slots,
+            so that a slot never spans two nodes.
+    """
+    if not resources:
+        return {}
+    if mode == "even":
+        return dict(zip(resources, split(sorted(os.sched_getaffinity(0)), len(resources))))
+    nodes = numa_nodes()
+    slots = [[] for _ in nodes]
+    for index, resource in enumerate(resources):
+        slots[index * len(nodes) // len(resources)].append(resource)
+    cpu_sets = {}
+    for node, node_slots in zip(nodes, slots):
+        if node_slots:
+            cpu_sets.update(zip(node_slots, split(node, len(node_slots))))
+    return cpu_sets
+
+
+def build_bindings(resources, bindings=None, mode=None, threads=None):
+    """
+    Cpus and thread limits of resource slots: {resource: {"cpus": [cpus], "threads": num}}.
+    bindings: declared in params.yaml, which take precedence over the automatic split by `mode`
+    threads: thread limit of slots without a declared one, by default the number of their cpus
+    """
+    bindings = {resource: dict(binding) for resource, binding in (bindings or {}).items()}
+    if threads is not None:
+        # plain resources are limited too, without being pinned
+        for resource in dict.fromkeys(resources):
+            bindings.setdefault(resource, {})
+    if mode:
+        # a resource listed several times shares its cpus
+        unbound = [r for r in dict.fromkeys(resources) if "cpus" not in bindings.get(r, {})]
+        for resource, cpus in split_cpus(unbound, mode).items():
+            bindings.setdefault(resource, {})["cpus"] = cpus
+    for binding in bindings.values():
+        if threads is not None and "threads" not in binding:
+            binding["threads"] = threads
+        elif "threads" not in binding and "cpus" in binding:
+            binding["threads"] = len(binding["cpus"])
+    return bindings
+
+
+def bind(bindings, resource):
+    """Binding of a resource, possibly several gpus (e.g. "0,1") of `--auto-gpu` each with its own binding"""
+    if not bindings:
+        return None
+    if resource in bindings:
+        return bindings[resource]
+    parts = [bindings[gpu] for gpu in resource.split(",") if gpu in bindings]
+    if not parts:
+        return None
+    binding = {"threads": sum(part.get("threads", 0) for part in parts)}
+    if all("cpus" in part for part in parts):
+        binding["cpus"] = sorted(set(cpu for part in parts for cpu in part["cpus"]))
+    return binding
+
+
+def thread_env(binding):
+    """Environment variables limiting threads of common numeric libraries"""
+    if not binding or not binding.get("threads"):
+        return {}
+    return {name: str(binding["threads"]) for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                                                       "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]}
+
+
+WARNED = []  # whether the missing taskset was reported
+
+
+def pin(binding):
+    """
+    Command prefix (argv) binding a shell, and so all its children, to the cpus of a binding, for `spawn`.
+    taskset sets the affinity before the shell starts: a preexec_fn may deadlock as the scheduler runs threads.
+    """
+    if not binding or "cpus" not in binding:
+        return None
+    if shutil.which("taskset") is None:
+        if not WARNED:
+            color_print("taskset (util-linux) not found, commands are not pinned to cpus.", "yellow")
+            WARNED.append(True)
+        return None
+    return ["taskset", "-c", format_cpulist(binding["cpus"])]
+
@@ -0,0 +1,202 @@
+import asyncio
+import collections
+import copy
+import shlex
+import time
+from .misc import GPU_QUERY, GPU_QUERY_ARGS, parse_gpu_info, sort_gpus
+
+
+class SlotPool(object):
+    """
+    Fixed `resource` slots as specified in params.yaml or by `-r`, each running one command at a time.
+    """
+
+    def __init__(self, resources):
+        self.free = list(resources)
+
+    async def ready(self):
+        pass
+
+    def check(self, demand):
+        pass
+
+    def acquire(self, demand):
+        """Return the resource to run a command on, or None if all slots are busy."""
+        if not self.free:
+            return None
+        return self.free.pop(0)
+
+    def release(self, demand, resource):
+        self.free.append(resource)
+
+    async def changed(self):
+        # slots only change when a task finishes
+        await asyncio.Future()
+
+
+class GpuTelemetry(object):
+    """
+    GPU states published by a background `nvidia-smi --loop-ms` process, parsed line by line
+    without blocking the event loop. `snapshot` returns the latest states of all gpus, which
+    are considered stale after `ttl` seconds. When `history` is given, every reading is appended
+    to it as a csv time series of memory and utilization per gpu.
+    """
+
+    def __init__(self, interval=10, ttl=None, history=None):
+        self.interval = interval
+        self.ttl = ttl if ttl is not None else 3 * interval
+        self.history = history
+        self.infos = {}  # gpu -> (time, states)
+        self.queried = asyncio.Event()  # at least one query finished
+        self.updated = asyncio.Event()
+        self.process = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_event_loop().create_task(self.poll())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+    async def poll(self):
+        history = open(self.history, "a", encoding="utf-8") if self.history else None
+        if history is not None and history.tell() == 0:
+            history.write(",".join(["time", "index"] + GPU_QUERY_ARGS[2:]) + "\n")
+        try:
+            # a single query first, so that `queried` means all gpus were read
+            once = True
+            while True:
+                # then a long running process streaming a reading every interval, respawned if it exits
+                cmd = shlex.split(GPU_QUERY) + ([] if once else ["--loop-ms={}".format(int(self.interval * 1000))])
+                try:
+                    self.process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                                        stderr=asyncio.subprocess.DEVNULL)
+                    async for line in self.process.stdout:
+                        self.update(line.decode(), history)
+                    await self.process.wait()
+                except (FileNotFoundError, PermissionError):
+                    pass
+                self.queried.set()
+                if not once:
+                    await asyncio.sleep(self.interval)
+                once = False
+        finally:
+            if history is not None:
+                history.close()
+
+    def update(self, line, history=None):
+        if not line.strip():
+            return
+        try:
+            index, info = parse_gpu_info(line)
+        except ValueError:
+            # e.g. "[N/A]" readings
+            return
+        now = time.time()
+        self.infos[index] = (now, info)
+        if history is not None:
+            history.write(",".join([str(now), index] + [str(info[key]) for key in GPU_QUERY_ARGS[2:]]) + "\n")
+            history.flush()
+        self.updated.set()
+
+    def snapshot(self):
+        """Non-blocking read of fresh gpu states, in the format of `query_gpus`"""
+        now = time.time()
+        return {index: copy.copy(info) for index, (t, info) in self.infos.items() if now - t < self.ttl}
+
+    async def wait(self, timeout=None):
+        """Wait for the next reading"""
+        self.updated.clear()
+        try:
+            await asyncio.wait_for(self.updated.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class GpuPool(object):
+    """
+    Pack commands onto gpus by memory, with gpu states read from `GpuTelemetry`.
+    A command needs `_gpus` gpus (1 by default), each with `_mem` MiB free (by default `--min-mem`).
+    A command without memory estimate takes a whole gpu.
+    Free memory of a gpu is the lower one of
+    1. what nvidia-smi reports, minus tasks started within `settle` seconds that nvidia-smi does not see yet
+    2. its total memory minus what our running tasks declared
+    Among gpus with enough memory, commands go to the least loaded ones.
+    """
+
+    def __init__(self, telemetry, gpus=None, min_mem=None, settle=60):
+        self.telemetry = telemetry
+        self.gpus = gpus  # candidate gpu indices, all gpus if None
+        self.min_mem = min_mem
+        self.settle = settle
+        self.running = collections.defaultdict(list)  # gpu -> [(start time, mem)] of our commands
+
+    def demand(self, demand):
+        mem = demand.get("mem", None)
+        return mem if mem is not None else self.min_mem, demand.get("gpus", None) or 1
+
+    async def ready(self):
+        await self.telemetry.queried.wait()
+        if not self.telemetry.infos:
+            raise ValueError("No GPU found by nvidia-smi.")
+
+    def check(self, demand):
+        mem, num = self.demand(demand)
+        infos = {index: info for index, (_, info) in self.telemetry.infos.items()
+                 if self.gpus is None or index in self.gpus}
+        if num > len(infos):
+            raise ValueError("Command requires {} gpus, only {} available.".format(num, len(infos)))
+        if mem is not None and sum(1 for info in infos.values() if info["memory.total"] > mem) < num:
+            raise ValueError("Command requires {} gpus with {} MiB memory.".format(num, mem))
+
+    def free(self, gpu, info, now):
+        tasks = self.running[gpu]
+        if any(mem is None for _, mem in tasks):
+            return 0
+        reported = info["memory.free"] - sum(mem for start, mem in tasks if now - start < self.settle)
+        declared = info["memory.total"] - sum(mem for _, mem in tasks)
+        return min(reported, declared)
+
+    def acquire(self, demand):
+        """Return the gpus (e.g. "0,1") to run a command on, or None if it does not fit now."""
+        gpu_infos = self.telemetry.snapshot()
+        mem, num = self.demand(demand)
+        now = time.time()
+        gpus = [gpu for gpu in (self.gpus or gpu_infos.keys()) if gpu in gpu_infos]
+        for gpu in gpus:
+            gpu_infos[gpu]["memory.free"] = self.free(gpu, gpu_infos[gpu], now)
+        if mem is None:
+            gpus = [gpu for gpu in gpus if not self.running[gpu]]
+        else:
+            gpus = [gpu for gpu in gpus if gpu_infos[gpu]["memory.free"] > mem]
+        if len(gpus) < num:
+            return None
+        # fewer of our tasks first, then the order of `sort_gpus`
+        gpus = sorted(sort_gpus(gpus, mem, gpu_infos), key=lambda gpu: len(self.running[gpu]))[:num]
+        for gpu in gpus:
+            self.running[gpu].append((now, mem))
+        return ",".join(gpus)
+
+    def release(self, demand, resource):
+        mem, _ = self.demand(demand)
+        for gpu in resource.split(","):
+            for placement in self.running[gpu]:
+                if placement[1] == mem:
+                    self.running[gpu].remove(placement)
+                    break
+
+    async def changed(self):
+        await self.telemetry.wait()
+
+
+def build_pool(args, resources, telemetry=None):
+    if not args.auto_gpu:
+        return SlotPool(resources)
+    # resources give the candidate gpus
+    gpus = sorted(set(gpu.strip() for resource in resources for gpu in resource.split(",")))
+    return GpuPool(telemetry, gpus, min_mem=args.min_mem)
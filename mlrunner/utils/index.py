@@ -0,0 +1,134 @@
+import importlib.util
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from .misc import yaml_load
+
+COLUMNS = ["name", "mtime", "param", "stat", "metric"]
+
+
+def index_format():
+    # parquet needs pyarrow, fall back to a pickled data frame without it
+    return "parquet" if importlib.util.find_spec("pyarrow") is not None else "pickle"
+
+
+def stamp(path):
+    """Latest mtime of an experiment directory and its `param` and `stat` files, which are edited in place"""
+    mtime = 0
+    for name in ("", "param", "stat"):
+        try:
+            mtime = max(mtime, os.stat(os.path.join(path, name)).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return mtime
+
+
+class ExperimentIndex(object):
+    """
+    Params, stats and parsed metrics of all experiments under an output directory in a single columnar file
+    (`.index.parquet`, or `.index.pkl` without pyarrow), loaded in one read instead of a yaml parse per experiment.
+    One row per experiment: name, mtime, param and stat as json, metric pickled.
+    The file is only a cache of the experiment directories: `reconcile` re-reads directories whose mtime changed.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.rows = {}  # name -> row
+        self.changed = set()
+        self.saved = time.time()
+
+    def path(self, fmt=None):
+        return self.root / (".index.parquet" if (fmt or index_format()) == "parquet" else ".index.pkl")
+
+    def read(self):
+        import pandas as pd
+        fmt = index_format()
+        path = self.path(fmt)
+        if not path.exists():
+            return {}
+        try:
+            df = pd.read_parquet(path) if fmt == "parquet" else pd.read_pickle(path)
+        except Exception:
+            # corrupted or incompatible index, rebuild it
+            return {}
+        return {row["name"]: row for row in df.to_dict("records")}
+
+    def load(self):
+        self.rows = self.read()
+        self.changed.clear()
+        return self
+
+    def update(self, path, metric=None):
+        """Re-read `param` and `stat` of an experiment. Parsed metrics are dropped unless given."""
+        path = Path(path)
+        files = {}
+        for file in ("param", "stat"):
+            try:
+                files[file] = yaml_load(path / file) or {}
+            except FileNotFoundError:
+                files[file] = {}
+        self.rows[path.name] = {"name":   path.name,
+                                "mtime":  stamp(path),
+                                "param":  json.dumps(files["param"], default=str),
+                                "stat":   json.dumps(files["stat"], default=str),
+                                "metric": None if metric is None else pickle.dumps(metric)}
+        self.changed.add(path.name)
+
+    def put_metric(self, name, metric):
+        self.rows[name]["metric"] = pickle.dumps(metric)
+        self.changed.add(name)
+
+    def reconcile(self):
+        """Sync with experiment directories by their mtime. Return names of new or changed experiments."""
+        updated = []
+        names = set()
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_dir() or not os.path.exists(os.path.join(entry.path, "param")):
+                    continue
+                names.add(entry.name)
+                row = self.rows.get(entry.name, None)
+                if row is None or row["mtime"] != stamp(entry.path):
+                    self.update(entry.path)
+                    updated.append(entry.name)
+        for name in set(self.rows) - names:
+            del self.rows[name]
+            self.changed.add(name)
+        return updated
+
+    def param(self, name):
+        return json.loads(self.rows[name]["param"])
+
+    def stat(self, name):
+        return json.loads(self.rows[name]["stat"])
+
+    def metric(self, name):
+        data = self.rows[name]["metric"]
+        return None if data is None else pickle.loads(data)
+
+    def save(self, interval=None):
+        """Merge changed rows into the index file. With `interval`, skip if saved less than `interval` seconds ago."""
+        if not self.changed or (interval is not None and time.time() - self.saved < interval):
+            return
+        import pandas as pd
+        # other processes may have written the file since it was read
+        rows = self.read()
+        for name in self.changed:
+            if name in self.rows:
+                rows[name] = self.rows[name]
+            else:
+                rows.pop(name, None)
+        self.rows = rows
+        df = pd.DataFrame.from_records([rows[name] for name in sorted(rows)], columns=COLUMNS)
+        fmt = index_format()
+        path = self.path(fmt)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        if fmt == "parquet":
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+        self.changed.clear()
+        self.saved = time.time()
@@ -0,0 +1,206 @@
+import glob
+import gzip
+import importlib.util
+import os
+import re
+import sys
+import time
+
+EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# log.{command}.{time}[.{name}], then .part{n} for rotated segments and the extension of the compression
+SEGMENT = re.compile(r"^(?P<base>.*?)(?:\.part(?P<part>\d+))?(?P<ext>\.gz|\.zst)?$")
+
+
+def has_zstd():
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def segment_path(base, part, compress=None):
+    """Path of the `part`-th segment of a log: base, base.part1, base.part2, ... with the compression extension"""
+    return "{}{}{}".format(base, ".part{}".format(part) if part else "", EXTENSIONS[compress])
+
+
+def split_segment(path):
+    """Segment path -> (base path, part)"""
+    match = SEGMENT.match(str(path))
+    return match.group("base"), int(match.group("part") or 0)
+
+
+def log_segments(base):
+    """Existing segments of a log in order, the oldest ones may be removed by rotation"""
+    base = str(base)
+    parts = []
+    for path in glob.glob(glob.escape(base) + "*"):
+        seg_base, part = split_segment(path)
+        if seg_base == base:
+            parts.append((part, path))
+    return [path for _, path in sorted(parts)]
+
+
+def open_segment(path):
+    """Binary reader of a segment, decompressed"""
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                           closefd=True)
+    return open(path, "rb")
+
+
+class LogSink(object):
+    """
+    Streaming log of a command. Carriage-return progress updates (e.g. tqdm) are collapsed into their last state
+    when their line ends. With `max_size` (bytes before compression), the log is split into segments
+    base, base.part1, ... and only the last `keep` segments are kept. Segments are compressed with `compress`
+    (gzip or zstd) and flushed within `flush` seconds, uncompressed ones after each write,
+    so that logs of running commands can be read.
+    """
+
+    def __init__(self, base, max_size=None, keep=None, compress=None, echo=False, flush=1):
+        self.base = str(base)
+        self.max_size = max_size
+        self.keep = keep
+        self.compress = compress
+        self.echo = echo  # also write to stdout, as in debug mode
+        self.flush_interval = flush
+        self.line = b""  # incomplete last line
+        self.part = 0
+        self.size = 0
+        self.raw = None
+        self.file = None
+        self.flushed = time.time()
+        self.pending = False  # written since the last flush
+        self.open()
+
+    def open(self):
+        self.raw = open(segment_path(self.base, self.part, self.compress), "wb")
+        if self.compress == "gzip":
+            self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        elif self.compress == "zstd":
+            import zstandard
+            self.file = zstandard.ZstdCompressor().stream_writer(self.raw)
+        else:
+            self.file = self.raw
+        self.size = 0
+
+    def close_segment(self):
+        if self.file is not self.raw:
+            self.file.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+    def rotate(self):
+        self.close_segment()
+        self.part += 1
+        if self.keep is not None and self.part >= self.keep:
+            try:
+                os.remove(segment_path(self.base, self.part - self.keep, self.compress))
+            except FileNotFoundError:
+                pass
+        self.open()
+
+    def emit(self, data):
+        if not data:
+            return
+        if self.max_size and self.size and self.size + len(data) > self.max_size:
+            self.rotate()
+        self.file.write(data)
+        self.size += len(data)
+        self.pending = True
+
+    def write(self, data):
+        if self.echo:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+        lines = (self.line + data).split(b"\n")
+        self.line = lines.pop()
+        if lines:
+            self.emit(b"".join(collapse(line) + b"\n" for line in lines))
+        # only the last state of a progress bar matters
+        cut = self.line.rfind(b"\r", 0, len(self.line) - 1)
+        if cut >= 0:
+            self.line = self.line[cut + 1:]
+        if len(self.line) > 1 << 20:
+            # a very long line without a newline
+            self.emit(self.line)
+            self.line = b""
+        # compressed segments are flushed less often, each flush ends a compressed block
+        if self.pending and (self.file is self.raw or time.time() - self.flushed > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.file is not self.raw:
+            # a sync flush, readable without closing the stream
+            if self.compress == "zstd":
+                import zstandard
+                self.file.flush(zstandard.FLUSH_BLOCK)
+            else:
+                self.file.flush()
+        self.raw.flush()
+        self.flushed = time.time()
+        self.pending = False
+
+    def close(self):
+        if self.line:
+            self.emit(collapse(self.line))
+            self.line = b""
+        self.close_segment()
+
+
+def collapse(line):
+    """Last state of a line rewritten with carriage returns"""
+    line = line.rstrip(b"\r")
+    return line[line.rfind(b"\r") + 1:]
+
+
+async def capture(stream, sink, size=1 << 16):
+    """Write a subprocess stream to a sink until EOF, flushing what is written when the stream is idle"""
+    import asyncio
+    try:
+        while True:
+            try:
+                # reading is cancelled without losing data
+                data = await asyncio.wait_for(stream.read(size), sink.flush_interval if sink.pending else None)
+            except asyncio.TimeoutError:
+                sink.flush()
+                continue
+            if not data:
+                break
+            sink.write(data)
+    finally:
+        sink.close()
+
+
+def log_options(args):
+    return {"max_size": int(args.log_max_size * (1 << 20)) if args.log_max_size else None,
+            "keep": args.log_keep, "compress": args.log_compress, "echo": args.debug}
+
+
+async def spawn(script, log, options=None, prefix=None, **kwargs):
+    """
+    Start a shell script with its stdout and stderr written to the log `log` by a `LogSink` with `options`.
+    prefix: argv running the shell, e.g. taskset. Other keyword arguments are passed to
+    `asyncio.create_subprocess_exec`. Return the process and its reader.
+    """
+    # asyncio is left out of readers of logs
+    import asyncio
+    process = await asyncio.create_subprocess_exec(*(prefix or []), "/bin/bash", "-c", script,
+                                                   stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                   **kwargs)
+    reader = asyncio.ensure_future(capture(process.stdout, LogSink(log, **(options or {}))))
+    return process, reader
+
+
+async def finish(process, reader, timeout=10):
+    """Wait for a process started by `spawn` and the rest of its output"""
+    import asyncio
+    try:
+        await process.wait()
+        # background children may keep the pipe open, don't wait for them forever
+        await asyncio.wait([reader], timeout=timeout)
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+    return process.returncode
@@ -1,21 +1,37 @@
-import glob
 import os
 import json
 import yaml
 import re
-import collections
-import json
-import curses
 import shlex
-import tabulate
-import itertools
+import functools
 import time
 from contextlib import contextmanager
 from pathlib import Path
-from ilock import ILock, ILockException
 
 
 # GPU sorting
+GPU_QUERY_ARGS = ['index', 'gpu_name', 'memory.free', 'memory.used', 'memory.total', 'utilization.gpu']
+GPU_QUERY = 'nvidia-smi --query-gpu={} --format=csv,noheader'.format(','.join(GPU_QUERY_ARGS))
+
+
+def parse_gpu_info(line):
+    """Parse a csv line of GPU_QUERY into the gpu index and its states"""
+
+    def parse(key, value):
+        if key in ['memory.free', 'memory.total', 'memory.used']:
+            return int(value.upper().strip().replace('MIB', ''))
+        elif key == 'utilization.gpu':
+            return int(value.replace('%', '').strip())
+        else:
+            return value.strip()
+
+    info_dict = {key: parse(key, value)
+                 for key, value in zip(GPU_QUERY_ARGS, line.strip().split(','))}
+    index = info_dict['index']
+    del (info_dict['index'])
+    return index, info_dict
+
+
 def query_gpus():
     """
     return dictionary structure:
@@ -33,33 +49,21 @@ def query_gpus():
            }
      }
     """
-    query_args = ['index', 'gpu_name', 'memory.free', 'memory.used', 'memory.total', 'utilization.gpu']
-    cmd = 'nvidia-smi --query-gpu={} --format=csv,noheader'.format(','.join(query_args))
-
-    def parse(key, value):
-        if key in ['memory.free', 'memory.total', 'memory.used']:
-            return int(value.upper().strip().replace('MIB', ''))
-        elif key == 'utilization.gpu':
-            return int(value.replace('%', '').strip())
-        else:
-            return value.strip()
-
     gpu_infos = {}
-    for info in os.popen(cmd).readlines():
-        info_dict = {key: parse(key, value)
-                     for key, value in zip(query_args, info.strip().split(','))}
-        index = info_dict['index']
-        del (info_dict['index'])
+    for line in os.popen(GPU_QUERY).readlines():
+        index, info_dict = parse_gpu_info(line)
         gpu_infos[index] = info_dict
     return gpu_infos
 
 
-def sort_gpus(gpus, min_mem=None):
+def sort_gpus(gpus, min_mem=None, gpu_infos=None):
     """
     Sort a list of single gpus
+    gpu_infos: output of `query_gpus`, queried if not given
     """
     gpus = list(set(gpus))
-    gpu_infos = query_gpus()
+    if gpu_infos is None:
+        gpu_infos = query_gpus()
     if min_mem is not None:
         valid_gpus = [(gpu_infos[gpu]["memory.free"], gpu) for gpu in gpus if
                       gpu_infos[gpu]["memory.free"] > min_mem]
@@ -75,6 +79,7 @@ def sort_gpus(gpus, min_mem=None):
 
 
 # naming
+@functools.lru_cache(maxsize=None)
 def snake2camel(snake_str, shrink_keep=0):
     """
     "a_snake_case_string" or "a-snake-case-string" to "ASnakeCaseString"
@@ -202,6 +207,8 @@ def yaml_dump(d, filename):
 @contextmanager
 def edit_yaml(output, file):
     # read&write yaml with lock
+    # ilock (and portalocker) only when a yaml is edited
+    from ilock import ILock, ILockException
     path = Path(output, file)
     if not path.exists():
         path.touch()
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import runpy
+import signal
+from pathlib import Path
+from .misc import color_print
+
+
+def load_parsers(specs):
+    """Load parsers given as `file.py:func`, with the signature of `Examiner.add`."""
+    parsers = []
+    for spec in specs:
+        path, _, name = spec.rpartition(":")
+        if not path or not name:
+            raise ValueError("parser '{}' should be given as file.py:func".format(spec))
+        functions = runpy.run_path(path)
+        if not callable(functions.get(name, None)):
+            raise ValueError("'{}' is not a function in {}".format(name, path))
+        parsers.append(functions[name])
+    return parsers
+
+
+class Pruner(object):
+    """
+    Early termination of hopeless commands. Every `interval` seconds, parsers fill `metric` (and `step`)
+    of running commands from their logs, as `Examiner` does.
+    With `rungs` (asynchronous successive halving): when a command reaches a rung (its step >= the rung),
+    its metric is ranked with those of all commands at the same rung so far, including those reaching it
+    in the same check, and it is stopped if it falls in the worst `fraction`.
+    Without rungs, every step a command reports is a rung: at each check, a command that reports a new step is
+    ranked with all commands that reported the same step, so commands are only ranked at the same progress.
+    Commands without a step are not compared.
+    Stopped commands are killed with their process group and marked `pruned`, freeing their resources.
+    """
+
+    def __init__(self, parsers, metric, mode="max", fraction=0.5, rungs=None, step="step", interval=60,
+                 commands=None):
+        self.parsers = parsers
+        self.metric = metric
+        self.sign = 1 if mode == "max" else -1  # larger scores are better
+        self.fraction = fraction
+        self.rungs = sorted(rungs) if rungs else []
+        self.step = step
+        self.interval = interval
+        self.commands = commands  # commands to prune, by default all
+        self.caches = {}
+        self.running = {}  # (output, command) -> [process, spec, index of the next rung, last step compared]
+        self.records = {}  # (command, rung) -> scores of commands reaching the rung
+        self.pruned = set()  # (output, command)
+
+    def watches(self, command):
+        return self.commands is None or command in self.commands
+
+    def track(self, output, command, spec, process):
+        self.running[(output, command)] = [process, spec, 0, None]
+
+    def untrack(self, output, command):
+        self.running.pop((output, command), None)
+
+    def is_pruned(self, output, command):
+        return (output, command) in self.pruned
+
+    def score(self, output, spec):
+        # imported here to keep pandas out of `run` without pruning
+        from ..examine.examiner import Experiment
+        experiment = Experiment(cache={}, metric={}, param=spec)
+        try:
+            for parser in self.parsers:
+                parser(Path(output), experiment, self.caches)
+        except Exception as exception:
+            color_print("Parser failed on {}: {!r}".format(output, exception), "yellow")
+            return None, None
+        if experiment.metric.get(self.metric, None) is None:
+            return None, None
+        return self.sign * float(experiment.metric[self.metric]), experiment.metric.get(self.step, None)
+
+    def cutoff(self, scores):
+        # nearest-rank quantile: scores below it are in the worst `fraction`
+        scores = sorted(scores)
+        return scores[min(int(self.fraction * len(scores)), len(scores) - 1)]
+
+    def check(self, entries):
+        """Return (output, command) of running commands to stop, given `running` entries as a list of items"""
+        stops = []
+        reached = []  # (key, rung, score) of rungs reached in this check
+        for key, entry in entries:
+            _, spec, rung, compared = entry
+            score, step = self.score(key[0], spec)
+            if score is None or step is None:
+                continue
+            step = float(step)
+            rungs = []
+            if self.rungs:
+                while rung < len(self.rungs) and step >= self.rungs[rung]:
+                    rungs.append(self.rungs[rung])
+                    rung += 1
+                entry[2] = rung
+            elif step != compared:
+                rungs.append(step)
+                entry[3] = step
+            for value in rungs:
+                self.records.setdefault((key[1], value), []).append(score)
+                reached.append((key, value, score))
+        # ranked once all scores of this check are recorded, so that the order of commands doesn't matter
+        for key, value, score in reached:
+            if key not in stops and score < self.cutoff(self.records[(key[1], value)]):
+                stops.append(key)
+        return stops
+
+    def stop(self, output, command):
+        if (output, command) not in self.running:
+            # finished while its log was parsed
+            return
+        process = self.running[(output, command)][0]
+        self.pruned.add((output, command))
+        color_print("PRUNE   {}: {}".format(command, output), "yellow")
+        try:
+            # the shell and its children
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # parsers read whole logs, which would stall log capture and dispatch on the event loop
+            stops = await asyncio.get_event_loop().run_in_executor(None, self.check, list(self.running.items()))
+            for output, command in stops:
+                self.stop(output, command)
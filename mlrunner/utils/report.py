@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from ..reporting import ENV_SOCKET, ENV_OUTPUT, ENV_COMMAND, append_chunk
+
+
+class ReportServer(object):
+    """
+    Unix socket receiving metrics sent by `mlrunner.report` from running commands, one json record per line:
+    {"output": ..., "command": ..., "time": ..., "metrics": {...}}
+    Records are buffered and appended to the `report` file of each experiment every `interval` seconds.
+    Commands find the socket and their experiment through environment variables set by `env`.
+    """
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.dir = None
+        self.path = None
+        self.server = None
+        self.flushing = None
+        self.buffers = {}  # output -> records
+
+    async def start(self):
+        # socket paths are limited to ~100 bytes, output directories may be longer
+        self.dir = tempfile.mkdtemp(prefix="mlrunner-")
+        self.path = os.path.join(self.dir, "report.sock")
+        self.server = await asyncio.start_unix_server(self.handle, self.path)
+        self.flushing = asyncio.ensure_future(self.loop())
+
+    def env(self, output, command):
+        # commands may change their working directory
+        return {ENV_SOCKET: self.path, ENV_OUTPUT: os.path.abspath(output), ENV_COMMAND: command}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    record = json.loads(line)
+                    output = record["output"]
+                    entry = dict(record["metrics"], _command=record.get("command", None),
+                                 _time=record.get("time", None))
+                except (ValueError, KeyError, TypeError):
+                    continue
+                self.buffers.setdefault(output, []).append(entry)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    def flush(self):
+        buffers, self.buffers = self.buffers, {}
+        for output, records in buffers.items():
+            try:
+                append_chunk(output, records)
+            except OSError:
+                pass
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    async def stop(self):
+        self.flushing.cancel()
+        await asyncio.gather(self.flushing, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+        self.flush()
+        shutil.rmtree(self.dir, ignore_errors=True)
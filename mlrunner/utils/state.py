@@ -0,0 +1,427 @@
+import os
+import json
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from .misc import edit_yaml, yaml_load, yaml_dump, color_print
+
+HOST = socket.gethostname()
+
+
+def merge_param(prev_spec, spec):
+    if not prev_spec:
+        prev_spec.update(spec)
+    else:
+        for key, value in spec.items():
+            # don't overwrite old commands
+            if key == "_scripts" and key in prev_spec:
+                prev_spec[key].update(value)
+            else:
+                prev_spec[key] = value
+    return prev_spec
+
+
+def new_heartbeat():
+    return {"pid": os.getpid(), "host": HOST, "time": time.time()}
+
+
+def is_alive(heartbeat, ttl):
+    """Whether the `run` process marking a command as running is still alive"""
+    if not heartbeat:
+        return False
+    if heartbeat.get("host", None) == HOST:
+        try:
+            os.kill(heartbeat["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    return time.time() - heartbeat.get("time", 0) < ttl
+
+
+def should_skip(output, command, status, force=False, heartbeat=None, ttl=None):
+    if force:
+        return False
+    if status == "running" and ttl is not None and not is_alive(heartbeat, ttl):
+        color_print("Stale running command '{}' of {}, rerun it.".format(command, output), "yellow")
+        return False
+    return status in ["finished", "running", "pruned"]
+
+
+class YamlState(object):
+    """
+    Run states kept in the `param` and `stat` yaml files of each experiment directory.
+    Every access takes a file lock and does a full load&dump of the file.
+    Heartbeats of running commands are kept in `.heartbeat.<command>` files, refreshed without lock.
+    """
+
+    def __init__(self, root, ttl=None):
+        self.root = root
+        self.ttl = ttl  # seconds before a running command without heartbeat is considered lost
+        self.alive = set()  # (output, command) running in this process
+
+    def update_param(self, output, spec):
+        with edit_yaml(output, "param") as prev_spec:
+            merge_param(prev_spec, spec)
+
+    def begin(self, output, command, force=False):
+        """Mark the command as running. Return False if it should be skipped."""
+        heartbeat_path = Path(output, ".heartbeat." + command)
+        with edit_yaml(output, "stat") as stat:
+            status = stat.get(command, None)
+            heartbeat = yaml_load(heartbeat_path) if status == "running" and heartbeat_path.exists() else None
+            if should_skip(output, command, status, force, heartbeat, self.ttl):
+                return False
+            stat[command] = "running"
+            atomic_yaml_dump(new_heartbeat(), heartbeat_path)
+        self.alive.add((output, command))
+        return True
+
+    def beat(self):
+        """Refresh heartbeats of commands running in this process"""
+        for output, command in self.alive:
+            atomic_yaml_dump(new_heartbeat(), os.path.join(output, ".heartbeat." + command))
+
+    def transition(self, transitions, durations=None):
+        """
+        Batched status updates: an iterable of (output, command, status).
+        durations: {(output, command): seconds} of finished commands, kept under `_durations` in `stat`.
+        """
+        updates = {}
+        for output, command, status in transitions:
+            updates.setdefault(output, {})[command] = status
+        for output, update in updates.items():
+            with edit_yaml(output, "stat") as stat:
+                stat.update(update)
+                for (duration_output, command), seconds in (durations or {}).items():
+                    if duration_output == output:
+                        stat.setdefault("_durations", {})[command] = round(seconds, 1)
+            for command, status in update.items():
+                if status != "running" and (output, command) in self.alive:
+                    self.alive.remove((output, command))
+                    try:
+                        os.unlink(os.path.join(output, ".heartbeat." + command))
+                    except FileNotFoundError:
+                        pass
+
+    def retry_after(self, output, command):
+        # commands running elsewhere are skipped
+        return None
+
+    def status(self, output):
+        path = Path(output, "stat")
+        if not path.exists():
+            return {}
+        return yaml_load(path) or {}
+
+    def export(self, outputs=None):
+        # the yaml files are the states themselves
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteState(object):
+    """
+    Run states kept in a single sqlite database (WAL mode) under the output root,
+    written by the local `run` process without per-file locks.
+    `export` writes the `param` and `stat` files of changed experiments for `Examiner`.
+    """
+
+    def __init__(self, root, ttl=None, filename="state.db"):
+        self.root = root
+        self.ttl = ttl  # seconds before a running command without heartbeat is considered lost
+        self.alive = set()  # (output, command) running in this process
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, filename), timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS param (output TEXT PRIMARY KEY, spec TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stat (output TEXT, command TEXT, status TEXT, "
+                          "PRIMARY KEY (output, command))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS heartbeat (output TEXT, command TEXT, heartbeat TEXT, "
+                          "PRIMARY KEY (output, command))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS duration (output TEXT, command TEXT, seconds REAL, "
+                          "PRIMARY KEY (output, command))")
+        self.seeded = set()
+        self.dirty = set()
+
+    def seed(self, output):
+        # pick up states left by previous yaml-based runs
+        if output in self.seeded:
+            return
+        self.seeded.add(output)
+        if self.conn.execute("SELECT 1 FROM stat WHERE output=? LIMIT 1", (output,)).fetchone():
+            return
+        stat_path = Path(output, "stat")
+        if stat_path.exists():
+            stat = yaml_load(stat_path) or {}
+            durations = stat.pop("_durations", {})
+            self.conn.executemany("INSERT OR IGNORE INTO stat VALUES (?, ?, ?)",
+                                  [(output, command, status) for command, status in stat.items()])
+            self.conn.executemany("INSERT OR IGNORE INTO duration VALUES (?, ?, ?)",
+                                  [(output, command, seconds) for command, seconds in durations.items()])
+
+    def update_param(self, output, spec):
+        self.seed(output)
+        row = self.conn.execute("SELECT spec FROM param WHERE output=?", (output,)).fetchone()
+        if row is None:
+            param_path = Path(output, "param")
+            prev_spec = (yaml_load(param_path) or {}) if param_path.exists() else {}
+        else:
+            prev_spec = json.loads(row[0])
+        merge_param(prev_spec, spec)
+        self.conn.execute("INSERT OR REPLACE INTO param VALUES (?, ?)", (output, json.dumps(prev_spec, default=str)))
+        self.dirty.add(output)
+
+    def begin(self, output, command, force=False):
+        """Mark the command as running. Return False if it should be skipped."""
+        self.seed(output)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT status, heartbeat FROM stat LEFT JOIN heartbeat USING (output, command) "
+                                    "WHERE output=? AND command=?", (output, command)).fetchone()
+            status, heartbeat = row if row else (None, None)
+            if should_skip(output, command, status, force, json.loads(heartbeat) if heartbeat else None, self.ttl):
+                return False
+            self.conn.execute("INSERT OR REPLACE INTO stat VALUES (?, ?, 'running')", (output, command))
+            self.conn.execute("INSERT OR REPLACE INTO heartbeat VALUES (?, ?, ?)",
+                              (output, command, json.dumps(new_heartbeat())))
+        finally:
+            self.conn.execute("COMMIT")
+        self.alive.add((output, command))
+        self.dirty.add(output)
+        return True
+
+    def beat(self):
+        """Refresh heartbeats of commands running in this process"""
+        heartbeat = json.dumps(new_heartbeat())
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("UPDATE heartbeat SET heartbeat=? WHERE output=? AND command=?",
+                                  [(heartbeat, output, command) for output, command in self.alive])
+        finally:
+            self.conn.execute("COMMIT")
+
+    def transition(self, transitions, durations=None):
+        """
+        Batched status updates in a single transaction: an iterable of (output, command, status).
+        durations: {(output, command): seconds} of finished commands.
+        """
+        transitions = list(transitions)
+        ended = [(output, command) for output, command, status in transitions if status != "running"]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT OR REPLACE INTO stat VALUES (?, ?, ?)", transitions)
+            self.conn.executemany("DELETE FROM heartbeat WHERE output=? AND command=?", ended)
+            self.conn.executemany("INSERT OR REPLACE INTO duration VALUES (?, ?, ?)",
+                                  [(output, command, round(seconds, 1))
+                                   for (output, command), seconds in (durations or {}).items()])
+        finally:
+            self.conn.execute("COMMIT")
+        self.alive.difference_update(ended)
+        self.dirty.update(output for output, _, _ in transitions)
+
+    def retry_after(self, output, command):
+        # commands running elsewhere are skipped
+        return None
+
+    def status(self, output):
+        self.seed(output)
+        return dict(self.conn.execute("SELECT command, status FROM stat WHERE output=?", (output,)))
+
+    def export(self, outputs=None):
+        """Write `param` and `stat` files of the given (by default all changed) experiments."""
+        outputs = set(self.dirty) if outputs is None else set(outputs)
+        for output in outputs:
+            if not os.path.isdir(output):
+                continue
+            row = self.conn.execute("SELECT spec FROM param WHERE output=?", (output,)).fetchone()
+            if row is not None:
+                atomic_yaml_dump(json.loads(row[0]), os.path.join(output, "param"))
+            stat = self.status(output)
+            durations = dict(self.conn.execute("SELECT command, seconds FROM duration WHERE output=?", (output,)))
+            if durations:
+                stat["_durations"] = durations
+            atomic_yaml_dump(stat, os.path.join(output, "stat"))
+        self.dirty.difference_update(outputs)
+
+    def close(self):
+        self.export()
+        self.conn.close()
+
+
+class ClaimState(object):
+    """
+    Run states of several `run` processes, possibly on different hosts, sharing an output directory without a server
+    or file locks. A process claims a whole task before touching it, by creating `.claim.<generation>` in its
+    directory with O_EXCL, and then is the only writer of its `param` and `stat`.
+    Each process refreshes a single heartbeat file under `output/.workers` for all its claims. A claim whose worker
+    stopped its heartbeat for `ttl` seconds is taken over by creating the next generation, which only one process
+    can do, so that no task runs twice. Claims held by others are checked again every `ttl` seconds
+    until their commands end.
+    """
+
+    def __init__(self, root, ttl=None):
+        self.root = root
+        self.ttl = ttl if ttl is not None else 120
+        self.worker = "{}.{}".format(HOST, os.getpid())
+        self.workers = os.path.join(root, ".workers")
+        os.makedirs(self.workers, exist_ok=True)
+        self.beat()
+        self.claims = {}  # output -> claim file of this process
+        self.lost = {}  # output claimed by another process -> when it was found claimed
+
+    def worker_alive(self, worker):
+        host, _, pid = worker.rpartition(".")
+        if not pid.isdigit():
+            return False
+        try:
+            mtime = os.stat(os.path.join(self.workers, worker)).st_mtime
+        except FileNotFoundError:
+            return False
+        return is_alive({"host": host, "pid": int(pid), "time": mtime}, self.ttl)
+
+    def claim(self, output):
+        """Whether this process owns the task of `output`, claiming it if nobody alive does"""
+        if output in self.claims:
+            return True
+        if output in self.lost:
+            if time.time() - self.lost[output] < self.ttl:
+                return False
+            # its owner may have stopped since
+            del self.lost[output]
+        os.makedirs(output, exist_ok=True)
+        generations = [int(name.rpartition(".")[2]) for name in os.listdir(output)
+                       if name.startswith(".claim.") and name.rpartition(".")[2].isdigit()]
+        generation = max(generations, default=-1)
+        if generation >= 0:
+            path = os.path.join(output, ".claim.{}".format(generation))
+            try:
+                with open(path) as fin:
+                    owner = fin.read().strip()
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                # replaced by a newer generation meanwhile
+                self.lost[output] = time.time()
+                return False
+            if not owner and age < self.ttl:
+                # created but not written yet
+                self.lost[output] = time.time()
+                return False
+            if owner == self.worker:
+                self.claims[output] = os.path.join(output, ".claim.{}".format(generation))
+                return True
+            if self.worker_alive(owner):
+                self.lost[output] = time.time()
+                return False
+        path = os.path.join(output, ".claim.{}".format(generation + 1))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            # claimed or taken over by another process in the meantime
+            self.lost[output] = time.time()
+            return False
+        with os.fdopen(fd, "w") as fout:
+            fout.write(self.worker)
+        self.claims[output] = path
+        for old in generations:
+            try:
+                os.unlink(os.path.join(output, ".claim.{}".format(old)))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def retry_after(self, output, command):
+        """
+        Seconds before checking again a command of a task claimed by another process,
+        False if it failed or was pruned there, so that its dependents are dropped, None if it is not held.
+        """
+        if output not in self.lost:
+            return None
+        status = self.load(output, "stat").get(command, None)
+        if status == "finished":
+            return None
+        if status in ["failed", "pruned"]:
+            return False
+        return max(self.lost[output] + self.ttl - time.time(), 0)
+
+    def update_param(self, output, spec):
+        if not self.claim(output):
+            return
+        atomic_yaml_dump(merge_param(self.load(output, "param"), spec), os.path.join(output, "param"))
+
+    def begin(self, output, command, force=False):
+        """Mark the command as running. Return False if it should be skipped."""
+        if not self.claim(output):
+            return False
+        stat = self.load(output, "stat")
+        # commands left running by the previous owner of the claim are lost
+        if should_skip(output, command, stat.get(command, None), force, None, self.ttl):
+            return False
+        stat[command] = "running"
+        atomic_yaml_dump(stat, os.path.join(output, "stat"))
+        return True
+
+    def beat(self):
+        """A single heartbeat for all claims of this process"""
+        path = os.path.join(self.workers, self.worker)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            open(path, "w").close()
+
+    def transition(self, transitions, durations=None):
+        """Batched status updates: an iterable of (output, command, status)."""
+        updates = {}
+        for output, command, status in transitions:
+            updates.setdefault(output, {})[command] = status
+        for output, update in updates.items():
+            stat = self.load(output, "stat")
+            stat.update(update)
+            for (duration_output, command), seconds in (durations or {}).items():
+                if duration_output == output:
+                    stat.setdefault("_durations", {})[command] = round(seconds, 1)
+            atomic_yaml_dump(stat, os.path.join(output, "stat"))
+
+    def load(self, output, file):
+        path = Path(output, file)
+        return (yaml_load(path) or {}) if path.exists() else {}
+
+    def status(self, output):
+        return self.load(output, "stat")
+
+    def export(self, outputs=None):
+        # the yaml files are the states themselves
+        pass
+
+    def close(self):
+        for path in self.claims.values():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.unlink(os.path.join(self.workers, self.worker))
+        except FileNotFoundError:
+            pass
+
+
+def atomic_yaml_dump(d, filename):
+    # readers never see a partially written file
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    yaml_dump(d, tmp)
+    os.replace(tmp, filename)
+
+
+STATES = {
+    "yaml":   YamlState,
+    "sqlite": SqliteState,
+    "claim":  ClaimState,
+}
+
+
+def build_state(name, root, ttl=None):
+    return STATES[name](root, ttl=ttl)
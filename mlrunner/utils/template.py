@@ -0,0 +1,68 @@
+import re
+from .misc import map_placeholder, map_replacement
+from .config import InvalidYAMLException
+
+# {param} -> value, [param] -> --param value
+PARAM_PATTERN = re.compile(r"{[\w\-\_]+?}|\[[\w\-\_]+?\]")
+
+
+class CommandTemplate(object):
+    """
+    A command template compiled once into literal and param segments:
+    "python train.py {data} [lr]" -> ["python train.py ", (map_placeholder, "data"), " ", (map_replacement, "lr")]
+    Rendering a spec then only fills the param segments.
+    """
+
+    def __init__(self, template, aliases):
+        template = re.sub(r"\s*\n\s*", " ", template)  # clean up line breaks
+        self.segments = []
+        self.tokens = {}  # param -> "{param}" or "[param]"
+        placeholders = set()
+        replacements = set()
+        start = 0
+        for match in PARAM_PATTERN.finditer(template):
+            token = match.group()
+            param = token[1:-1]
+            if param in aliases:
+                raise InvalidYAMLException("alias param '{}' should not be specified in template.".format(param))
+            if token[0] == "{":
+                placeholders.add(param)
+                mapper = map_placeholder
+            else:
+                replacements.add(param)
+                mapper = map_replacement
+            if match.start() > start:
+                self.segments.append(template[start:match.start()])
+            self.segments.append((mapper, param))
+            self.tokens[param] = token
+            start = match.end()
+        if start < len(template):
+            self.segments.append(template[start:])
+
+        intersect = placeholders & replacements
+        if intersect:
+            raise InvalidYAMLException("duplicate params in placeholder and replacement: {}".format(intersect))
+        self.params = placeholders | replacements
+        self.rendered = {}  # (param, type, value) -> rendered segment, values repeat a lot across a sweep
+        # literal segments with braces escaped, params as positional fields
+        self.fields = [segment for segment in self.segments if not isinstance(segment, str)]
+        self.format = "".join(segment.replace("{", "{{").replace("}", "}}") if isinstance(segment, str) else "{}"
+                              for segment in self.segments)
+
+    def render(self, spec):
+        if not spec.keys() >= self.params:
+            empties = set(self.tokens[param] for param in self.params if param not in spec)
+            raise InvalidYAMLException("params {} are not specified in 'default' or 'choice'".format(empties))
+        return self.format.format(*[self.render_param(spec, mapper, param) for mapper, param in self.fields])
+
+    def render_param(self, spec, mapper, param):
+        value = spec[param]
+        try:
+            # True == 1 and hash(True) == hash(1), so the type is part of the key
+            key = (param, type(value), value)
+            if key not in self.rendered:
+                self.rendered[key] = mapper(spec, param)
+            return self.rendered[key]
+        except TypeError:
+            # unhashable value, leave the error reporting to the mapper
+            return mapper(spec, param)
@@ -0,0 +1,157 @@
+import json
+import time
+
+
+def slot_label(pool, resource):
+    # remote slots are futures of agents' offers
+    if pool == "cpu":
+        return "cpu"
+    return "gpu {}".format(resource) if isinstance(resource, str) else "remote"
+
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return "{:.1f}s".format(seconds)
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return "{}h{:02d}m{:02d}s".format(hours, minutes, seconds)
+    return "{}m{:02d}s".format(minutes, seconds)
+
+
+class Tracer(object):
+    """
+    Timeline of a run: for each command, when it became ready (its dependencies finished), when it got a slot,
+    when its process started and ended, its status and exit code, and the slot (lane) it held.
+    Concurrent commands on slots with the same label (e.g. `resource: [0, 0]`, or gpus shared with `--auto-gpu`)
+    are put on separate lanes.
+    """
+
+    def __init__(self):
+        self.origin = time.time()
+        self.records = {}  # (task index, command) -> record
+        self.lanes = {}  # slot label -> busy lanes
+
+    def ready(self, index, command):
+        self.records[(index, command)] = {"task": index, "command": command, "ready": time.time()}
+
+    def acquire(self, index, command, pool, resource):
+        label = slot_label(pool, resource)
+        lanes = self.lanes.setdefault(label, [])
+        lane = lanes.index(False) if False in lanes else len(lanes)
+        if lane == len(lanes):
+            lanes.append(True)
+        lanes[lane] = True
+        self.records[(index, command)].update(pool=pool, slot=label, lane=lane, acquired=time.time())
+
+    def start(self, index, command, output):
+        self.records[(index, command)].update(output=output, start=time.time())
+
+    def finish(self, index, command, status, code=None):
+        record = self.records[(index, command)]
+        record.update(status=status, code=code)
+        if "start" in record:
+            record["end"] = time.time()
+
+    def release(self, index, command):
+        record = self.records[(index, command)]
+        record["released"] = time.time()
+        self.lanes[record["slot"]][record["lane"]] = False
+
+    def relative(self, record):
+        return {key: round(value - self.origin, 6) if key in ("ready", "acquired", "start", "end", "released")
+                else value for key, value in record.items()}
+
+    def write(self, path):
+        """JSON lines of commands with a `.jsonl` path, a Chrome trace (chrome://tracing, Perfetto) otherwise"""
+        records = [self.relative(record) for record in sorted(self.records.values(), key=lambda r: r["ready"])]
+        with open(path, "w") as fout:
+            if path.endswith(".jsonl"):
+                for record in records:
+                    fout.write(json.dumps(record) + "\n")
+                return
+            threads = {}  # (slot, lane) -> thread id
+            events = []
+            for record in records:
+                if "acquired" not in record:
+                    continue
+                thread = threads.setdefault((record["slot"], record["lane"]), len(threads) + 1)
+                name = "{}: {}".format(record["command"], record.get("output", record["task"]))
+                args = {key: record.get(key) for key in ("task", "status", "code")}
+                args["queue_wait"] = record["acquired"] - record["ready"]
+                if "start" in record and "end" in record:
+                    events.append({"name": name, "cat": record["pool"], "ph": "X", "pid": 1, "tid": thread,
+                                   "ts": record["start"] * 1e6, "dur": (record["end"] - record["start"]) * 1e6,
+                                   "args": args})
+                elif "released" in record:
+                    # skipped: the slot was only held to check the state
+                    events.append({"name": name, "cat": record["pool"], "ph": "i", "s": "t", "pid": 1,
+                                   "tid": thread, "ts": record["acquired"] * 1e6, "args": args})
+            for (slot, lane), thread in threads.items():
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread,
+                               "args": {"name": "{} #{}".format(slot, lane) if lane else slot}})
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fout)
+
+    def critical_path(self, tasks):
+        """The chain of dependent commands with the longest total runtime: [(task index, command, duration)]"""
+        best = []
+        best_length = 0
+        for index, task in enumerate(tasks):
+            graph = task["graph"]
+            memo = {}  # command -> (length, chain) of the longest chain ending with it
+
+            def longest(command):
+                if command not in memo:
+                    record = self.records.get((index, command), {})
+                    duration = record["end"] - record["start"] if "end" in record else 0
+                    length, chain = max((longest(dependency) for dependency in graph[command]["after"]),
+                                        key=lambda item: item[0], default=(0, []))
+                    memo[command] = (length + duration, chain + [(index, command, duration)])
+                return memo[command]
+
+            for command in graph:
+                length, chain = longest(command)
+                if length > best_length:
+                    best_length, best = length, chain
+        return [link for link in best if link[2] > 0]
+
+    def summary(self, tasks):
+        """Lines of the end-of-run report: makespan, queue waits, busy time of each slot and the critical path"""
+        records = [record for record in self.records.values() if "end" in record]
+        if not records:
+            return []
+        start = min(record["start"] for record in records)
+        makespan = max(record["end"] for record in records) - start
+        waits = [record["acquired"] - record["ready"] for record in self.records.values() if "acquired" in record]
+        lines = ["Makespan: {}, commands run: {}, queue wait: mean {}, max {}".format(
+                format_seconds(makespan), len(records), format_seconds(sum(waits) / len(waits)),
+                format_seconds(max(waits)))]
+        slots = {}
+        for record in records:
+            slots.setdefault(record["slot"], []).append((record["start"], record["end"]))
+        lines.append("{:12} {:>6} {:>11} {:>9}".format("slot", "busy", "concurrent", "commands"))
+        for slot, intervals in sorted(slots.items()):
+            # busy: at least one command running, concurrent: average number of running commands
+            union = 0
+            current_start, current_end = None, None
+            for begin, end in sorted(intervals):
+                if current_end is None or begin > current_end:
+                    if current_end is not None:
+                        union += current_end - current_start
+                    current_start, current_end = begin, end
+                else:
+                    current_end = max(current_end, end)
+            union += current_end - current_start
+            total = sum(end - begin for begin, end in intervals)
+            lines.append("{:12} {:>5.0f}% {:>11.2f} {:>9}".format(slot, 100 * union / makespan if makespan else 100,
+                                                                 total / makespan if makespan else 1,
+                                                                 len(intervals)))
+        path = self.critical_path(tasks)
+        if path:
+            length = sum(duration for _, _, duration in path)
+            lines.append("Critical path: {} ({:.0f}% of makespan), {}".format(
+                    format_seconds(length), 100 * length / makespan if makespan else 100,
+                    tasks[path[0][0]]["spec"]["_output"]))
+            lines.append("    " + " -> ".join("{} {}".format(command, format_seconds(duration))
+                                              for _, command, duration in path))
+        return lines
@@ -31,11 +31,12 @@ setuptools.setup(
             "Operating System :: POSIX :: Linux",
         ],
         install_requires=['pyyaml', 'tabulate', 'ilock', 'pandas', "dill==0.3.6", "multiprocess==0.70.14"],
+        extras_require={'parquet': ['pyarrow'], 'zstd': ['zstandard']},
         packages=setuptools.find_packages(),
         python_requires='>=3.7',
         entry_points={
             'console_scripts': [
-                'run = mlrunner.run:main'
+                'run = mlrunner.cli:main'
             ]
         }
 )
@@ -0,0 +1,60 @@
+from mlrunner.cli import build_parser
+from mlrunner.run import build_tasks, freeze, spec_key
+from mlrunner.utils.config import load_yaml
+
+
+def tasks_of(tmp_path, text, *argv):
+    path = tmp_path / "params.yaml"
+    path.write_text(text)
+    args = build_parser().parse_args(["-y", str(path), "-o", str(tmp_path / "output")] + list(argv))
+    resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
+    return build_tasks(args, templates, aliases, defaults, choices)
+
+
+def test_freeze_nested_values():
+    value = {"b": [1, {"c": 2}], "a": (3,)}
+    assert freeze(value) == (("a", (3,)), ("b", (1, (("c", 2),))))
+    hash(freeze(value))
+
+
+def test_spec_key_ignores_key_order():
+    assert spec_key({"lr": 0.1, "layers": [64, 64]}) == spec_key({"layers": [64, 64], "lr": 0.1})
+    assert spec_key({"lr": 0.1, "layers": [64, 64]}) != spec_key({"lr": 0.1, "layers": [64, 32]})
+
+
+def test_duplicated_choices_run_once(tmp_path):
+    tasks = tasks_of(tmp_path, """
+template:
+  train: "echo {lr} {model}"
+default:
+  lr: 0.1
+  model: mlp
+resource: [ "0" ]
+---
+lr: [0.1, 0.01]
+model: [cnn]
+---
+model: [cnn]
+lr: [0.01, 0.001]
+""")
+    assert [task["scripts"]["train"] for task in tasks] == ["echo 0.1 cnn", "echo 0.01 cnn", "echo 0.001 cnn"]
+
+
+def test_same_spec_with_other_commands_is_kept(tmp_path):
+    # the same experiment, another choice runs its second command
+    tasks = tasks_of(tmp_path, """
+template:
+  train: "echo train {lr}"
+  test: "echo test {lr}"
+default:
+  lr: 0.1
+resource: [ "0" ]
+---
+_cmd: [train]
+lr: [0.1]
+---
+_cmd: [test]
+lr: [0.1]
+""")
+    assert [list(task["scripts"]) for task in tasks] == [["train"], ["test"]]
+    assert tasks[0]["spec"]["_output"] == tasks[1]["spec"]["_output"]
@@ -0,0 +1,86 @@
+import asyncio
+import csv
+import os
+import stat
+import sys
+import pytest
+from mlrunner.utils.gpu import GpuTelemetry, GpuPool
+
+# index, name, memory.free, memory.used, memory.total, utilization.gpu
+GPUS = ["0, Fake GPU, 16000 MiB, 0 MiB, 16000 MiB, 0 %",
+        "1, Fake GPU, 4000 MiB, 12000 MiB, 16000 MiB, 50 %"]
+
+NVIDIA_SMI = """#!{python}
+import sys
+import time
+assert any(arg.startswith("--query-gpu=") for arg in sys.argv), sys.argv
+loop = [int(arg.split("=")[1]) for arg in sys.argv if arg.startswith("--loop-ms=")]
+while True:
+    print("\\n".join({gpus!r}), flush=True)
+    if not loop:
+        break
+    time.sleep(loop[0] / 1000)
+"""
+
+
+@pytest.fixture
+def nvidia_smi(tmp_path, monkeypatch):
+    path = tmp_path / "bin" / "nvidia-smi"
+    path.parent.mkdir()
+    path.write_text(NVIDIA_SMI.format(python=sys.executable, gpus=GPUS))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(path.parent) + os.pathsep + os.environ["PATH"])
+    return path
+
+
+def with_pool(func, history=None, **kwargs):
+    async def run():
+        telemetry = GpuTelemetry(interval=0.05, history=history)
+        telemetry.start()
+        try:
+            pool = GpuPool(telemetry, **kwargs)
+            await pool.ready()
+            return func(pool)
+        finally:
+            await telemetry.stop()
+    return asyncio.run(run())
+
+
+def test_telemetry(nvidia_smi, tmp_path):
+    history = str(tmp_path / "gpu_history.csv")
+    infos = with_pool(lambda pool: pool.telemetry.snapshot(), history=history)
+    assert infos["0"]["memory.free"] == 16000 and infos["1"]["memory.used"] == 12000
+    with open(history) as fin:
+        rows = list(csv.DictReader(fin))
+    assert rows and {row["index"] for row in rows} == {"0", "1"}
+    assert rows[0]["memory.total"] == "16000" and float(rows[0]["time"]) > 0
+
+
+def test_pack_by_memory(nvidia_smi):
+    def acquire(pool):
+        # gpu 0 fits three commands of 5000 MiB, gpu 1 only has 4000 MiB free
+        placed = [pool.acquire({"mem": 5000}) for _ in range(4)]
+        # smaller ones still fit, on the gpu with fewer of our commands first
+        placed += [pool.acquire({"mem": 500}), pool.acquire({"mem": 3000})]
+        pool.release({"mem": 5000}, "0")
+        placed.append(pool.acquire({"mem": 5000}))
+        return placed
+
+    assert with_pool(acquire) == ["0", "0", "0", None, "1", "1", "0"]
+
+
+def test_whole_gpus(nvidia_smi):
+    def acquire(pool):
+        # commands without memory demand take whole gpus
+        return [pool.acquire({"gpus": 2}), pool.acquire({}), pool.acquire({"mem": 100})]
+
+    assert with_pool(acquire) == ["0,1", None, None]
+
+
+def test_candidate_gpus(nvidia_smi):
+    def acquire(pool):
+        with pytest.raises(ValueError):
+            pool.check({"gpus": 2})
+        return [pool.acquire({"mem": 3000}), pool.acquire({"mem": 3000})]
+
+    assert with_pool(acquire, gpus=["1"]) == ["1", None]
@@ -0,0 +1,54 @@
+"""
+Import-time budget of the entry points, measured with `python -X importtime`: an entry point should not import
+a heavy module it does not need, and its imports should fit in the budget.
+Budgets are multiplied by the environment variable IMPORT_TIME_SCALE (e.g. 2 on a slow machine).
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCALE = float(os.environ.get("IMPORT_TIME_SCALE", 1))
+
+# entry point -> (python code, budget in ms, modules it should not import)
+CASES = {
+    "run -h":          ("import sys; sys.argv = ['run', '-h']; from mlrunner.cli import main; main()", 60,
+                        ["asyncio", "yaml", "pandas", "numpy", "tabulate", "ilock", "multiprocess"]),
+    "import mlrunner": ("import mlrunner", 40,
+                        ["asyncio", "yaml", "pandas", "numpy", "tabulate", "ilock", "multiprocess"]),
+    "examine readers": ("from mlrunner.examine import tail, search, lines, latest_log, load_report", 60,
+                        ["asyncio", "pandas", "numpy", "tabulate", "ilock", "multiprocess"]),
+    "run scheduler":   ("import mlrunner.run", 250, ["pandas", "numpy", "tabulate", "ilock", "multiprocess"]),
+}
+
+
+def import_times(code):
+    """Cumulative import times (us) of top-level imports, and all imported modules, of code in a fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    top = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        modules.add(name)
+        # nested imports are indented by their depth
+        if len(fields[2]) - len(fields[2].lstrip()) == 1:
+            top[name] = int(fields[1])
+    return top, modules
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_import_time(name):
+    code, budget, forbidden = CASES[name]
+    # the interpreter startup (site, encodings, ...) is not counted
+    startup = import_times("pass")[0]
+    # best of several runs, the first one warms caches
+    runs = [import_times(code) for _ in range(3)]
+    total = min(sum(t for module, t in top.items() if module not in startup) for top, _ in runs) / 1000
+    assert sorted(module for module in forbidden if module in runs[-1][1]) == []
+    assert total <= budget * SCALE, "{} ms over the budget of {} ms".format(total, budget * SCALE)
@@ -0,0 +1,66 @@
+import os
+import pytest
+from mlrunner.examine.reader import latest_log, lines, search, tail
+from mlrunner.utils.log import LogSink, has_zstd, log_segments, open_segment, segment_path, split_segment
+
+COMPRESS = [None, "gzip", pytest.param("zstd", marks=pytest.mark.skipif(not has_zstd(), reason="no zstandard"))]
+
+
+def written(sink, data, chunk=7):
+    # as read from a pipe, in arbitrary chunks
+    for start in range(0, len(data), chunk):
+        sink.write(data[start:start + chunk])
+
+
+def test_segment_paths():
+    assert segment_path("log.train.1", 0) == "log.train.1"
+    assert segment_path("log.train.1", 2, "gzip") == "log.train.1.part2.gz"
+    assert split_segment("log.train.1.part2.gz") == ("log.train.1", 2)
+    assert split_segment("log.train.1.zst") == ("log.train.1", 0)
+    assert split_segment("log.train.1") == ("log.train.1", 0)
+
+
+def test_carriage_returns_collapse(tmp_path):
+    base = str(tmp_path / "log.train.1")
+    sink = LogSink(base)
+    written(sink, b"start\n" + b"".join(b"\r%3d%%" % i for i in range(101)) + b"\ndone\r\n" + b"10%\r20%")
+    sink.close()
+    with open(base, "rb") as fin:
+        assert fin.read() == b"start\n100%\ndone\n20%"
+
+
+@pytest.mark.parametrize("compress", COMPRESS)
+def test_rotation_keeps_last_segments(tmp_path, compress):
+    base = str(tmp_path / "log.train.1")
+    sink = LogSink(base, max_size=100, keep=3, compress=compress)
+    written(sink, b"".join(b"line %04d\n" % i for i in range(100)))
+    sink.close()
+    segments = log_segments(base)
+    assert segments == [segment_path(base, part, compress) for part in [7, 8, 9]]
+    # whole lines within max_size in each segment
+    for segment in segments:
+        with open_segment(segment) as fin:
+            data = fin.read()
+        assert len(data) <= 100 and data.endswith(b"\n")
+    assert list(lines(base)) == ["line %04d" % i for i in range(70, 100)]
+    assert tail(base, 2) == ["line 0098", "line 0099"]
+    assert search(base, r"line (\d+)5").group(1) == "009"
+
+
+@pytest.mark.parametrize("compress", COMPRESS)
+def test_flushed_log_is_readable_while_written(tmp_path, compress):
+    base = str(tmp_path / "log.train.1")
+    sink = LogSink(base, compress=compress, flush=0)
+    sink.write(b"epoch 1\nepoch 2\n")
+    sink.write(b"epoch")
+    assert list(lines(base)) == ["epoch 1", "epoch 2"]
+    sink.close()
+    assert list(lines(base)) == ["epoch 1", "epoch 2", "epoch"]
+
+
+def test_latest_log_of_compressed_segments(tmp_path):
+    for name in ["log.train.1.gz", "log.train.2.part1.gz", "log.train.2.part2.gz", "log.test.3"]:
+        open(os.path.join(str(tmp_path), name), "w").close()
+    assert latest_log("train", tmp_path) == tmp_path / "log.train.2"
+    assert latest_log("train", tmp_path, 0) == tmp_path / "log.train.1"
+    assert latest_log("train", tmp_path, -3) is None
@@ -0,0 +1,51 @@
+import pytest
+from mlrunner.utils.prune import Pruner
+
+# output -> (acc, epoch) reported by its log
+METRICS = {}
+
+
+def parse(path, experiment, caches):
+    if str(path) in METRICS:
+        experiment.metric["acc"], experiment.metric["epoch"] = METRICS[str(path)]
+
+
+def check(pruner, metrics):
+    METRICS.clear()
+    METRICS.update(metrics)
+    for output in metrics:
+        if (output, "train") not in pruner.running:
+            pruner.track(output, "train", {}, None)
+    return sorted(output for output, _ in pruner.check(list(pruner.running.items())))
+
+
+@pytest.mark.parametrize("order", [1, -1])
+@pytest.mark.parametrize("mode, worst", [("max", ["a", "b"]), ("min", ["c", "d"])])
+def test_prune_same_step(mode, worst, order):
+    pruner = Pruner([parse], "acc", mode=mode, step="epoch")
+    # commands at the same step are ranked together, whatever their order
+    metrics = dict(sorted({"a": (0.1, 1), "b": (0.2, 1), "c": (0.3, 1), "d": (0.4, 1)}.items(),
+                          reverse=order < 0))
+    assert check(pruner, metrics) == worst
+
+
+@pytest.mark.parametrize("mode, worst", [("max", ["a", "b"]), ("min", ["c", "d"])])
+def test_prune_rungs(mode, worst):
+    pruner = Pruner([parse], "acc", mode=mode, step="epoch", rungs=[2, 4])
+    assert check(pruner, {"a": (0.1, 1), "b": (0.2, 1), "c": (0.3, 1), "d": (0.4, 1)}) == []
+    assert check(pruner, {"a": (0.1, 2), "b": (0.2, 2), "c": (0.3, 3), "d": (0.4, 2)}) == worst
+
+
+def test_prune_only_at_the_same_progress():
+    pruner = Pruner([parse], "acc", mode="max", step="epoch")
+    # a command that just started is not ranked against one far ahead
+    assert check(pruner, {"late": (0.1, 1), "early": (0.9, 50)}) == []
+    # nor compared twice at the same step
+    assert check(pruner, {"late": (0.1, 1), "early": (0.9, 50)}) == []
+    # until it reaches the same step, and is ranked with the score recorded there
+    assert check(pruner, {"late": (0.5, 50), "early": (0.9, 50)}) == ["late"]
+
+
+def test_prune_needs_a_step():
+    pruner = Pruner([parse], "acc", mode="max", step="step")
+    assert check(pruner, {"a": (0.1, 1), "b": (0.9, 1)}) == []
@@ -0,0 +1,52 @@
+import pytest
+from mlrunner.cli import build_parser
+from mlrunner.run import build_tasks, rank_tasks
+from mlrunner.utils.config import InvalidYAMLException, load_yaml
+
+PARAMS = """
+template:
+  train: "echo {lr}"
+default:
+  lr: 0.1
+resource: [ "0" ]
+---
+lr: [1, 2]
+_cost: 10
+---
+lr: [3, 4]
+_priority: 1
+"""
+
+
+def tasks_of(tmp_path, text):
+    path = tmp_path / "params.yaml"
+    path.write_text(text)
+    args = build_parser().parse_args(["-y", str(path), "-o", str(tmp_path / "output")])
+    resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
+    return build_tasks(args, templates, aliases, defaults, choices)
+
+
+def order(tasks):
+    return [task["scripts"]["train"] for task in sorted(tasks, key=lambda task: task["rank"])]
+
+
+def test_priority_goes_first(tmp_path):
+    tasks = tasks_of(tmp_path, PARAMS)
+    rank_tasks(tasks)
+    assert order(tasks) == ["echo 3", "echo 4", "echo 1", "echo 2"]
+    rank_tasks(tasks, "fair")
+    assert order(tasks) == ["echo 3", "echo 4", "echo 1", "echo 2"]
+
+
+def test_longest_first(tmp_path):
+    tasks = tasks_of(tmp_path, PARAMS.replace("_priority: 1", "_priority: 0"))
+    # previous runs take precedence over `_cost`, commands without either take the mean
+    durations = {"Lr_2": {"train": 20}, "Lr_3": {"train": 15}}
+    rank_tasks(tasks, "lpt", durations)
+    assert order(tasks) == ["echo 2", "echo 3", "echo 4", "echo 1"]
+
+
+@pytest.mark.parametrize("hint", ["_priority: []", "_priority: [1, 2]", "_cost: fast", "_cost: true"])
+def test_invalid_hints(tmp_path, hint):
+    with pytest.raises(InvalidYAMLException, match="should be a single number"):
+        tasks_of(tmp_path, PARAMS.replace("_priority: 1", hint))
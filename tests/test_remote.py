@@ -0,0 +1,57 @@
+import asyncio
+import os
+import socket
+import yaml
+from mlrunner.cli import build_parser
+from mlrunner.remote import Agent
+from mlrunner.run import build_tasks, run_all
+from mlrunner.utils.config import load_yaml
+
+PARAMS = """
+template:
+  train: "sleep 0.0{b}"
+  post:
+    script: "echo {a} {b}"
+    _after: [ train ]
+    _resource: cpu
+default:
+  a: 1
+  b: 1
+resource: [ "0" ]
+---
+a: [1, 2, 3, 4, 5, 6]
+b: [1, 2, 3, 4, 5]
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def serve_with_agents(tmp_path, port):
+    path = tmp_path / "params.yaml"
+    path.write_text(PARAMS)
+    args = build_parser().parse_args(["-y", str(path), "-o", str(tmp_path / "output"), "--serve",
+                                      "127.0.0.1:{}".format(port), "--lease-ttl", "10"])
+    resources, bindings, templates, aliases, defaults, choices = load_yaml(args)
+    tasks = build_tasks(args, templates, aliases, defaults, choices)
+    agents = [Agent(("127.0.0.1", port), ["0", "0", "1", "1"], cpus=3, name="a"),
+              Agent(("127.0.0.1", port), ["2", "2"], cpus=2, name="b")]
+    await asyncio.gather(run_all(args, tasks, resources, bindings), *(agent.run(retry=5) for agent in agents))
+    return tasks
+
+
+def test_serve_with_several_agents(tmp_path):
+    # offers taken by the dispatcher used to be withdrawn by /lease before being leased, which is timing dependent
+    for attempt in range(4):
+        root = tmp_path / str(attempt)
+        root.mkdir()
+        tasks = asyncio.run(serve_with_agents(root, free_port()))
+        assert len(tasks) == 30
+        for task in tasks:
+            output = task["spec"]["_output"]
+            with open(os.path.join(output, "stat")) as fin:
+                stat = yaml.safe_load(fin)
+            assert stat["train"] == "finished" and stat["post"] == "finished", stat
@@ -0,0 +1,218 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+import yaml
+from mlrunner.utils.state import ClaimState, SqliteState, YamlState, build_state, is_alive, new_heartbeat
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DAG = """
+template:
+  train: "sleep 0.5; test {a} != 2"
+  test: { script: "sleep 0.2", _after: [ train ] }
+  post: { script: "true", _after: [ test ], _resource: cpu }
+default:
+  a: 1
+resource: [ "0" ]
+---
+a: [1, 2, 3, 4]
+"""
+
+
+def load_stat(output):
+    with open(os.path.join(output, "stat")) as fin:
+        return yaml.safe_load(fin)
+
+
+@pytest.fixture(params=["yaml", "sqlite", "claim"])
+def state(request, tmp_path):
+    state = build_state(request.param, str(tmp_path), ttl=60)
+    yield state
+    state.close()
+
+
+def test_begin_skips_started_commands(state, tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    assert state.begin(output, "train")
+    assert state.status(output) == {"train": "running"}
+    if not isinstance(state, ClaimState):
+        # running in this process, while a claimed task only has the commands its owner runs
+        assert not state.begin(output, "train")
+    # finished and pruned commands are not run again
+    state.transition([(output, "train", "finished"), (output, "test", "pruned")])
+    assert not state.begin(output, "train")
+    assert not state.begin(output, "test")
+    assert state.begin(output, "train", force=True)
+
+
+def test_failed_commands_run_again(state, tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    assert state.begin(output, "train")
+    state.transition([(output, "train", "failed")])
+    assert state.begin(output, "train")
+
+
+def test_transition_and_export(state, tmp_path):
+    outputs = [str(tmp_path / "A_{}".format(i)) for i in range(2)]
+    for output in outputs:
+        os.makedirs(output)
+        state.update_param(output, {"a": 1, "_scripts": {"train": "python train.py"}})
+        state.update_param(output, {"a": 2, "_scripts": {"test": "python test.py"}})
+        state.begin(output, "train")
+    state.transition([(output, "train", "finished") for output in outputs],
+                     durations={(outputs[0], "train"): 1.234})
+    state.export()
+    assert load_stat(outputs[0]) == {"train": "finished", "_durations": {"train": 1.2}}
+    assert load_stat(outputs[1]) == {"train": "finished"}
+    with open(os.path.join(outputs[0], "param")) as fin:
+        param = yaml.safe_load(fin)
+    # later params win, but scripts of earlier commands are kept
+    assert param == {"a": 2, "_scripts": {"train": "python train.py", "test": "python test.py"}}
+
+
+def test_sqlite_seeds_from_yaml_files(tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    with open(os.path.join(output, "stat"), "w") as fout:
+        yaml.safe_dump({"train": "finished", "test": "failed", "_durations": {"train": 3.0}}, fout)
+    state = SqliteState(str(tmp_path))
+    assert state.status(output) == {"train": "finished", "test": "failed"}
+    assert not state.begin(output, "train")
+    assert state.begin(output, "test")
+    state.close()
+    assert load_stat(output) == {"train": "finished", "test": "running", "_durations": {"train": 3.0}}
+
+
+def test_sqlite_states_persist(tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    state = SqliteState(str(tmp_path))
+    state.begin(output, "train")
+    state.transition([(output, "train", "finished")])
+    state.close()
+    state = SqliteState(str(tmp_path))
+    assert state.status(output) == {"train": "finished"}
+    assert not state.begin(output, "train")
+    state.close()
+
+
+def test_is_alive():
+    heartbeat = new_heartbeat()
+    assert is_alive(heartbeat, 60)
+    assert not is_alive(dict(heartbeat, time=time.time() - 120), 60)
+    # no such process on this host
+    assert not is_alive(dict(heartbeat, pid=2 ** 22 + 1), 60)
+    # processes of other hosts are only known by their heartbeats
+    assert is_alive(dict(heartbeat, host="elsewhere", pid=2 ** 22 + 1), 60)
+    assert not is_alive(None, 60)
+
+
+@pytest.mark.parametrize("State", [YamlState, SqliteState])
+def test_stale_running_command_runs_again(State, tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    state = State(str(tmp_path), ttl=1)
+    assert state.begin(output, "train")
+    other = State(str(tmp_path), ttl=1)
+    # kept alive by heartbeats
+    for _ in range(3):
+        time.sleep(0.4)
+        state.beat()
+        assert not other.begin(output, "train")
+    time.sleep(1.2)
+    assert other.begin(output, "train")
+    # without ttl, running commands are never considered lost
+    forever = State(str(tmp_path))
+    assert not forever.begin(output, "train")
+    state.transition([(output, "train", "finished")])
+    assert not os.path.exists(os.path.join(output, ".heartbeat.train"))
+    for each in [state, other, forever]:
+        each.close()
+
+
+def test_claim_is_exclusive(tmp_path):
+    output = str(tmp_path / "A_1")
+    first = ClaimState(str(tmp_path), ttl=60)
+    second = ClaimState(str(tmp_path), ttl=60)
+    # two processes of the same host
+    second.worker = "{}.{}".format(first.worker.rpartition(".")[0], os.getppid())
+    second.beat()
+    assert first.begin(output, "train")
+    assert not second.claim(output)
+    assert not second.begin(output, "test")
+    assert second.retry_after(output, "train") > 0
+    first.transition([(output, "train", "failed")])
+    assert second.retry_after(output, "train") is False
+    assert second.retry_after(tmp_path / "B_1", "train") is None
+    first.close()
+    assert os.listdir(output) == ["stat"]
+    second.close()
+
+
+def test_claim_of_dead_worker_is_taken_over(tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    with open(os.path.join(output, ".claim.0"), "w") as fout:
+        fout.write("{}.{}".format(ClaimState(str(tmp_path)).worker.rpartition(".")[0], 2 ** 22 + 1))
+    with open(os.path.join(output, "stat"), "w") as fout:
+        yaml.safe_dump({"train": "running"}, fout)
+    state = ClaimState(str(tmp_path), ttl=60)
+    assert state.claim(output)
+    assert sorted(os.listdir(output)) == [".claim.1", "stat"]
+    # left running by the dead worker
+    assert state.begin(output, "train")
+    state.close()
+
+
+def test_claim_empty_claim_file_is_in_progress(tmp_path):
+    output = str(tmp_path / "A_1")
+    os.makedirs(output)
+    open(os.path.join(output, ".claim.0"), "w").close()
+    state = ClaimState(str(tmp_path), ttl=60)
+    assert not state.claim(output)
+    assert state.retry_after(output, "train") > 0
+    state.close()
+
+
+def test_param_is_written_once_per_task(tmp_path, monkeypatch):
+    from mlrunner.cli import build_parser
+    from mlrunner.run import execute
+    path = tmp_path / "params.yaml"
+    path.write_text(DAG)
+    calls = []
+    update_param = YamlState.update_param
+    monkeypatch.setattr(YamlState, "update_param", lambda self, output, spec: calls.append(output) or
+                        update_param(self, output, spec))
+    monkeypatch.chdir(tmp_path)
+    execute(build_parser().parse_args(["-y", str(path), "-o", str(tmp_path / "output")]))
+    assert sorted(calls) == sorted(set(calls)) and len(calls) == 4
+    with open(str(tmp_path / "output" / "A_1" / "param")) as fin:
+        assert sorted(yaml.safe_load(fin)["_scripts"]) == ["post", "test", "train"]
+
+
+def test_claim_failure_in_another_process_drops_dependents(tmp_path):
+    path = tmp_path / "params.yaml"
+    path.write_text(DAG)
+    code = "import sys; sys.argv[0] = 'run'; from mlrunner.cli import main; main()"
+    command = [sys.executable, "-c", code, "-y", str(path), "-o", str(tmp_path / "output"),
+               "--state", "claim", "--heartbeat", "1"]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    processes = [subprocess.Popen(command, cwd=str(tmp_path), env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL) for _ in range(2)]
+    try:
+        for process in processes:
+            # both used to wait forever for dependents of the failed command
+            assert process.wait(timeout=60) == 0
+    finally:
+        for process in processes:
+            process.kill()
+    failed = load_stat(str(tmp_path / "output" / "A_2"))
+    assert failed["train"] == "failed" and "test" not in failed and "post" not in failed
+    for a in [1, 3, 4]:
+        stat = load_stat(str(tmp_path / "output" / "A_{}".format(a)))
+        assert stat["train"] == stat["test"] == stat["post"] == "finished", stat
+    assert os.listdir(str(tmp_path / "output" / ".workers")) == []
@@ -0,0 +1,49 @@
+import itertools
+import random
+import pytest
+from mlrunner.run import sweep, decode_index
+from mlrunner.utils.config import InvalidYAMLException
+
+GRID = {"lr": [0.1, 0.01], "seed": [0, 1, 2], "model": ["a", "b"]}
+
+
+def test_sweep_all_in_product_order():
+    expected = [dict(zip(GRID, values)) for values in itertools.product(*GRID.values())]
+    assert list(sweep(GRID)) == expected
+
+
+def test_sweep_is_lazy():
+    grid = {"p{}".format(i): list(range(100)) for i in range(10)}
+    assert next(sweep(grid)) == {key: 0 for key in grid}
+
+
+def test_decode_index_matches_product():
+    keys, choices = list(GRID), list(GRID.values())
+    for index, values in enumerate(itertools.product(*choices)):
+        assert decode_index(index, keys, choices) == dict(zip(keys, values))
+
+
+def test_sample_distinct_subset_in_grid_order():
+    random.seed(0)
+    every = list(sweep(GRID))
+    sample = list(sweep(GRID, num_sample=5))
+    assert len(sample) == 5
+    positions = [every.index(spec) for spec in sample]
+    assert positions == sorted(set(positions))
+
+
+def test_sample_larger_than_grid():
+    assert list(sweep(GRID, num_sample=100)) == list(sweep(GRID))
+
+
+def test_sample_huge_grid():
+    # more than 2**63 points, too many for random.sample(range(...))
+    grid = {"p{}".format(i): list(range(50)) for i in range(12)}
+    sample = list(sweep(grid, num_sample=20))
+    assert len(set(tuple(spec.values()) for spec in sample)) == 20
+    assert all(set(spec) == set(grid) for spec in sample)
+
+
+def test_sweep_rejects_scalars():
+    with pytest.raises(InvalidYAMLException):
+        list(sweep({"lr": 0.1}))
@@ -0,0 +1,41 @@
+import pytest
+from mlrunner.utils.config import InvalidYAMLException
+from mlrunner.utils.misc import map_placeholder, map_replacement
+from mlrunner.utils.template import CommandTemplate
+
+
+def test_compile_segments():
+    template = CommandTemplate("python train.py {data} [lr]", aliases={})
+    assert template.segments == ["python train.py ", (map_placeholder, "data"), " ", (map_replacement, "lr")]
+    assert template.params == {"data", "lr"}
+
+
+def test_render():
+    template = CommandTemplate("python train.py {data}\n    [lr] [fp16] [debug]", aliases={})
+    assert template.render({"data": "a b", "lr": 0.1, "fp16": True, "debug": False}) == \
+        "python train.py 'a b' --lr 0.1 --fp16 "
+
+
+def test_literal_braces_are_kept():
+    template = CommandTemplate('echo "{dict: {value}}"', aliases={})
+    assert template.render({"value": 3}) == 'echo "{dict: 3}"'
+
+
+def test_rendered_values_cached_by_type():
+    # True == 1, but they are rendered differently as flags
+    template = CommandTemplate("run [flag]", aliases={})
+    assert template.render({"flag": True}) == "run --flag"
+    assert template.render({"flag": 1}) == "run --flag 1"
+    assert template.render({"flag": True}) == "run --flag"
+
+
+def test_missing_param():
+    with pytest.raises(InvalidYAMLException):
+        CommandTemplate("run {data} [lr]", aliases={}).render({"data": 1})
+
+
+def test_invalid_templates():
+    with pytest.raises(InvalidYAMLException):
+        CommandTemplate("run {case}", aliases={"case": {}})
+    with pytest.raises(InvalidYAMLException):
+        CommandTemplate("run {lr} [lr]", aliases={})